@@ -0,0 +1,210 @@
+import os
+import numpy as np
+
+
+INDEX_DIR_NAME = "annotation_index"
+INDEX_VERSION = 2
+
+
+def index_file_path(index_dir, dataset_name):
+    return os.path.join(index_dir, f"{dataset_name}.npz")
+
+
+def parse_label_file(file_path):
+    """
+    Разбор YOLO аннотации на id классов и текст строк после id (с ведущим пробелом,
+    пробелы между значениями нормализованы, как в dataset_former.read_filtered_label).
+    Строки без целого id класса пропускаются.
+    """
+    classes = []
+    tails = []
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        try:
+            class_id = int(parts[0])
+        except ValueError:
+            continue
+        classes.append(class_id)
+        tails.append(" " + " ".join(parts[1:]) if len(parts) > 1 else "")
+
+    return classes, tails
+
+
+def scan_label_files(dataset_path, label_dirs):
+    """Список (относительный путь, mtime_ns, размер) для всех .txt файлов в каталогах аннотаций"""
+    entries = []
+    for labels_dir in label_dirs:
+        if not os.path.isdir(labels_dir):
+            continue
+        rel_dir = os.path.relpath(labels_dir, dataset_path)
+        with os.scandir(labels_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".txt") or not entry.is_file():
+                    continue
+                st = entry.stat()
+                entries.append((os.path.join(rel_dir, entry.name), st.st_mtime_ns, st.st_size))
+    entries.sort()
+    return entries
+
+
+def empty_index():
+    return {
+        "version": np.array(INDEX_VERSION),
+        "files": np.array([], dtype=str),
+        "mtimes": np.array([], dtype=np.int64),
+        "sizes": np.array([], dtype=np.int64),
+        "offsets": np.zeros(1, dtype=np.int64),
+        "classes": np.array([], dtype=np.int32),
+        "text": np.array([], dtype=np.uint8),
+    }
+
+
+def index_tails(index):
+    """Текст строк индекса после id класса (список по строкам; в файле хранится через \n в UTF-8)"""
+    if not len(index["classes"]):
+        return []
+    return index["text"].tobytes().decode("utf-8").split("\n")
+
+
+def load_index(index_path, version=INDEX_VERSION):
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with np.load(index_path, allow_pickle=False) as data:
+            index = {key: data[key] for key in data.files}
+    except Exception as e:
+        print(f"[WARNING] Не удалось прочитать индекс {index_path}: {e}")
+        return None
+    if int(index.get("version", -1)) != version:
+        return None
+    return index
+
+
+def save_index(index_path, index):
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + ".tmp.npz"
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, index_path)
+
+
+def update_index(dataset_path, label_dirs, index=None):
+    """
+    Обновление индекса датасета: повторно читаются только новые файлы
+    и файлы, у которых изменились mtime или размер.
+    Возвращает (новый индекс, число прочитанных файлов).
+    """
+    if index is None:
+        index = empty_index()
+
+    entries = scan_label_files(dataset_path, label_dirs)
+    if (
+        len(entries) == len(index["files"])
+        and np.array_equal(np.array([mtime for _, mtime, _ in entries], dtype=np.int64), index["mtimes"])
+        and np.array_equal(np.array([size for _, _, size in entries], dtype=np.int64), index["sizes"])
+        and [rel_path for rel_path, _, _ in entries] == index["files"].tolist()
+    ):
+        return index, 0
+
+    cached = {}
+    offsets = index["offsets"].tolist()
+    for file_id, name in enumerate(index["files"].tolist()):
+        cached[name] = (file_id, int(index["mtimes"][file_id]), int(index["sizes"][file_id]))
+    old_classes = index["classes"]
+    old_tails = index_tails(index)
+
+    files, mtimes, sizes = [], [], []
+    class_parts, tails = [], []
+    new_offsets = [0]
+    reparsed = 0
+
+    for rel_path, mtime, size in entries:
+        hit = cached.get(rel_path)
+        if hit is not None and hit[1] == mtime and hit[2] == size:
+            start, end = offsets[hit[0]], offsets[hit[0] + 1]
+            file_classes = old_classes[start:end]
+            tails.extend(old_tails[start:end])
+        else:
+            parsed_classes, parsed_tails = parse_label_file(os.path.join(dataset_path, rel_path))
+            file_classes = np.array(parsed_classes, dtype=np.int32)
+            tails.extend(parsed_tails)
+            reparsed += 1
+
+        files.append(rel_path)
+        mtimes.append(mtime)
+        sizes.append(size)
+        class_parts.append(file_classes)
+        new_offsets.append(new_offsets[-1] + len(file_classes))
+
+    if not files:
+        return empty_index(), reparsed
+
+    new_index = {
+        "version": np.array(INDEX_VERSION),
+        "files": np.array(files, dtype=str),
+        "mtimes": np.array(mtimes, dtype=np.int64),
+        "sizes": np.array(sizes, dtype=np.int64),
+        "offsets": np.array(new_offsets, dtype=np.int64),
+        "classes": np.concatenate(class_parts).astype(np.int32),
+        "text": np.frombuffer("\n".join(tails).encode("utf-8"), dtype=np.uint8),
+    }
+    return new_index, reparsed
+
+
+def refresh_index(index_dir, dataset_name, dataset_path, label_dirs):
+    """Загрузка индекса датасета, обновление измененных файлов и сохранение на диск"""
+    index_path = index_file_path(index_dir, dataset_name)
+    old_index = load_index(index_path)
+    index, reparsed = update_index(dataset_path, label_dirs, old_index)
+    if reparsed or old_index is None or len(index["files"]) != len(old_index["files"]):
+        save_index(index_path, index)
+    print(f"[INFO] Индекс {dataset_name}: {len(index['files'])} аннотаций, перечитано {reparsed}")
+    return index
+
+
+def make_index_filter(index, dataset_path, remap, fallback):
+    """
+    Функция фильтрации аннотаций по индексу: выбор и переиндексация классов
+    выполняются одной векторной операцией над всеми строками датасета,
+    строки результата собираются из исходного текста (как при фильтрации по тексту).
+    remap - {исходный id: новый id (str)}, fallback(label_path) - фильтрация по тексту
+    для файлов, которых нет в индексе.
+    """
+    classes = index["classes"]
+    lut_size = max(int(classes.max()) + 1 if len(classes) else 0, max(remap, default=-1) + 1)
+    lut = np.full(lut_size, -1, dtype=np.int32)
+    id_names = []
+    for src_id, new_id in remap.items():
+        if src_id >= 0:
+            lut[src_id] = len(id_names)
+            id_names.append(new_id)
+
+    new_ids = np.full(len(classes), -1, dtype=np.int32)
+    valid = classes >= 0
+    new_ids[valid] = lut[classes[valid]]
+    kept_rows = np.flatnonzero(new_ids >= 0)
+    kept_offsets = np.searchsorted(kept_rows, index["offsets"]).tolist()
+    kept_names = [id_names[i] for i in new_ids[kept_rows].tolist()]
+    kept_rows = kept_rows.tolist()
+    tails = index_tails(index)
+
+    names = index["files"].tolist()
+    file_ids = {os.path.join(dataset_path, name): file_id for file_id, name in enumerate(names)}
+    rel_ids = {name: file_id for file_id, name in enumerate(names)}
+
+    def filter_fn(label_path):
+        file_id = file_ids.get(label_path)
+        if file_id is None:
+            file_id = rel_ids.get(os.path.relpath(label_path, dataset_path))
+            if file_id is None:
+                return fallback(label_path)
+
+        start, end = kept_offsets[file_id], kept_offsets[file_id + 1]
+        return [kept_names[i] + tails[kept_rows[i]] + "\n" for i in range(start, end)]
+
+    return filter_fn
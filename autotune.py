@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import resource
+import traceback
+import multiprocessing
+import torch
+from ultralytics.cfg import get_cfg
+from ultralytics.data.build import build_dataloader, build_yolo_dataset
+from ultralytics.data.utils import check_det_dataset
+from ultralytics.nn.tasks import DetectionModel
+from ultralytics.utils import DEFAULT_CFG
+from ultralytics.utils.torch_utils import select_device
+
+
+AUTOTUNE_FILE = "autotune.json"
+AUTOTUNE_BATCHES = [4, 8, 16, 32, 64]
+AUTOTUNE_WORKERS = [0, 2, 4, 8]
+AUTOTUNE_STEPS = 3  # Замеряемых шагов обучения на один вариант (после одного шага прогрева)
+AUTOTUNE_MEMORY_FRACTION = 0.8  # Доля памяти устройства, доступная обучению, если бюджет не задан
+AUTOTUNE_MIN_GAIN = 0.05  # Больше воркеров выбирается, только если это ускоряет обучение хотя бы на 5%
+
+
+def available_cpus():
+    """Число ядер CPU, доступных процессу (с учетом привязки taskset/cgroup cpuset)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def run_probe(fn, *args):
+    """
+    Выполнение замера fn(*args) в дочернем процессе (fork): пиковая память процесса
+    относится только к этому замеру, а нехватка памяти завершает только его.
+    CUDA инициализируется только в дочерних процессах: после инициализации в основном процессе
+    CUDA недоступна в процессах, созданных fork.
+    Возвращает словарь результата или {"error": ...}.
+    """
+    ctx = multiprocessing.get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+
+    def target():
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            traceback.print_exc()
+            result = {"error": f"{type(e).__name__}: {e}"}
+        sender.send(result)
+
+    process = ctx.Process(target=target, daemon=False)
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        result = {"error": f"процесс замера завершился с кодом {process.exitcode}"}
+    return result
+
+
+def peak_memory(device):
+    """Пиковая память процесса замера в байтах: память CUDA или максимальный RSS процесса"""
+    if device.type == "cuda":
+        return int(torch.cuda.max_memory_reserved(device))
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_memory(device):
+    """Текущая память процесса в байтах до начала замера (RSS по /proc/self/statm или выделенная память CUDA)"""
+    if device.type == "cuda":
+        return int(torch.cuda.memory_reserved(device))
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def default_memory_budget(device):
+    """Бюджет памяти по умолчанию: AUTOTUNE_MEMORY_FRACTION от памяти GPU или оперативной памяти"""
+    if device.type == "cuda":
+        total = torch.cuda.get_device_properties(device).total_memory
+    else:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return int(total * AUTOTUNE_MEMORY_FRACTION)
+
+
+def resolve_device(device_arg, memory_budget):
+    """Выбор устройства и бюджета памяти по умолчанию (выполняется в дочернем процессе run_probe)"""
+    device = select_device(device_arg, verbose=False)
+    if memory_budget is None:
+        memory_budget = default_memory_budget(device)
+    return {"device": str(device), "memory_budget": memory_budget}
+
+
+def build_train_model(base_model, data, cfg, device):
+    """Модель для замера, как в DetectionTrainer.get_model: число классов датасета и веса base_model"""
+    model = DetectionModel(base_model.yaml, nc=data["nc"], ch=data.get("channels", 3), verbose=False)
+    model.load(base_model, verbose=False)
+    model.names = data["names"]
+    model.args = cfg
+    for name, param in model.named_parameters():
+        param.requires_grad = ".dfl" not in name
+    return model.to(device).train()
+
+
+def train_step(model, optimizer, batch, device):
+    for key, value in batch.items():
+        if isinstance(value, torch.Tensor):
+            batch[key] = value.to(device)
+    batch["img"] = batch["img"].float() / 255
+    loss, _ = model(batch)
+    loss.sum().backward()
+    optimizer.step()
+    optimizer.zero_grad(set_to_none=True)
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def loader_batches(loader):
+    """Бесконечная последовательность batch: InfiniteDataLoader выдает за один проход только одну эпоху"""
+    while True:
+        yield from loader
+
+
+def probe_config(base_model, dataset, data, cfg, device, batch_size, workers, reuse_batch):
+    """
+    Замер шагов обучения (прямой и обратный проход, шаг оптимизатора) для batch_size и workers.
+    reuse_batch=True - один загруженный batch повторяется (только вычисления модели),
+    иначе каждый шаг берет новый batch из загрузчика (вычисления вместе с загрузкой данных).
+    device - имя устройства из resolve_device (устройство выбирается в процессе замера).
+    """
+    device = select_device(device, verbose=False)
+    base_memory = current_memory(device)
+    model = build_train_model(base_model, data, cfg, device)
+    optimizer = torch.optim.SGD((p for p in model.parameters() if p.requires_grad), lr=1e-4, momentum=0.9)
+    loader = build_dataloader(dataset, batch_size, workers, shuffle=True, device=device)
+    batches = loader_batches(loader)
+    try:
+        batch = next(batches)
+        train_step(model, optimizer, dict(batch), device)
+        synchronize(device)
+
+        images = 0
+        start = time.perf_counter()
+        for _ in range(AUTOTUNE_STEPS):
+            if not reuse_batch:
+                batch = next(batches)
+            train_step(model, optimizer, dict(batch), device)
+            images += len(batch["im_file"])
+        synchronize(device)
+        seconds = time.perf_counter() - start
+    finally:
+        loader.close()
+
+    return {
+        "batch": batch_size,
+        "workers": loader.num_workers,
+        "images_per_second": round(images / seconds, 2),
+        "base_memory": base_memory,
+        "peak_memory": peak_memory(device),
+    }
+
+
+def estimate_memory(batch_probes, size):
+    """
+    Оценка пиковой памяти для batch size по предыдущим замерам: линейная экстраполяция
+    по двум последним замерам или по одному замеру: память сверх занятой до замера пропорциональна batch
+    (с запасом, так как часть ее - модель и оптимизатор). None - замеров нет.
+    """
+    if not batch_probes:
+        return None
+    last = batch_probes[-1]
+    if len(batch_probes) == 1:
+        return last["base_memory"] + (last["peak_memory"] - last["base_memory"]) * size / last["batch"]
+    prev = batch_probes[-2]
+    per_image = (last["peak_memory"] - prev["peak_memory"]) / (last["batch"] - prev["batch"])
+    return last["peak_memory"] + max(per_image, 0) * (size - last["batch"])
+
+
+def format_probe(probe):
+    if "error" in probe:
+        return f"batch {probe['batch']}, workers {probe['workers']}: ошибка ({probe['error']})"
+    return (f"batch {probe['batch']}, workers {probe['workers']}: {probe['images_per_second']:.1f} изобр/с, "
+            f"память {probe['peak_memory'] / 1024 ** 3:.2f} ГБ")
+
+
+def tune_training(data_yaml, base_model, img_size, memory_budget=None, batch=None, dataset_builder=None):
+    """
+    Подбор размера batch и числа воркеров загрузчика короткими замерами на датасете data_yaml.
+    1. Для кандидатов AUTOTUNE_BATCHES (если batch не задан) замеряются вычисления модели
+       на одном повторяемом batch; выбирается batch с наибольшим числом изображений в секунду
+       среди вариантов, пиковая память которых не превышает memory_budget (байты).
+       Следующий batch не замеряется, если оценка его памяти (estimate_memory) превышает бюджет.
+    2. Для выбранного batch замеряется полный шаг обучения с загрузкой данных при числе воркеров
+       из AUTOTUNE_WORKERS; большее число воркеров выбирается, только если ускорение больше AUTOTUNE_MIN_GAIN.
+    dataset_builder(cfg, img_path, batch, data, stride) - построение датасета (для шардов), по умолчанию build_yolo_dataset.
+    Возвращает словарь с выбранными batch и workers и всеми замерами.
+    """
+    if torch.cuda.is_initialized():
+        raise RuntimeError("CUDA уже инициализирована в этом процессе, замеры в дочерних процессах (fork) невозможны")
+
+    cfg = get_cfg(DEFAULT_CFG, {"data": data_yaml, "imgsz": img_size, "mode": "train"})
+    resolved = run_probe(resolve_device, cfg.device, memory_budget)
+    if "error" in resolved:
+        raise RuntimeError(f"Не удалось выбрать устройство: {resolved['error']}")
+    device, memory_budget = resolved["device"], resolved["memory_budget"]
+    data = check_det_dataset(data_yaml)
+    stride = max(int(base_model.stride.max()), 32)
+
+    candidates = [batch] if batch else AUTOTUNE_BATCHES
+    builder = dataset_builder if dataset_builder is not None else (
+        lambda cfg, img_path, batch, data, stride: build_yolo_dataset(cfg, img_path, batch, data, mode="train", stride=stride)
+    )
+    dataset = builder(cfg, data["train"], max(candidates), data, stride)
+    candidates = [size for size in candidates if size <= len(dataset)] or [min(candidates)]
+
+    print(f"[INFO] Автоподбор: устройство {device}, бюджет памяти {memory_budget / 1024 ** 3:.2f} ГБ, "
+          f"изображений в train {len(dataset)}")
+
+    batch_probes = []
+    for size in candidates:
+        estimate = estimate_memory(batch_probes, size)
+        if estimate is not None and estimate > memory_budget:
+            print(f"[INFO] batch {size}: оценка памяти {estimate / 1024 ** 3:.2f} ГБ превышает бюджет, "
+                  f"большие batch не проверяются")
+            break
+        probe = {"batch": size, "workers": 0}
+        probe.update(run_probe(probe_config, base_model, dataset, data, cfg, device, size, 0, True))
+        print(f"   - {format_probe(probe)}")
+        batch_probes.append(probe)
+        if "error" in probe or probe["peak_memory"] > memory_budget:
+            break
+
+    errors = [probe["error"] for probe in batch_probes if "error" in probe]
+    fitting = [probe for probe in batch_probes if "error" not in probe and probe["peak_memory"] <= memory_budget]
+    if not fitting and len(errors) == len(batch_probes):
+        raise RuntimeError(f"Все замеры batch завершились ошибкой: {errors[0]}")
+    if not fitting:
+        raise RuntimeError("Ни один размер batch не укладывается в бюджет памяти")
+    best_batch = max(fitting, key=lambda probe: probe["images_per_second"])["batch"]
+
+    worker_probes = []
+    best = None
+    for workers in [w for w in AUTOTUNE_WORKERS if w <= available_cpus()]:
+        probe = {"batch": best_batch, "workers": workers}
+        probe.update(run_probe(probe_config, base_model, dataset, data, cfg, device, best_batch, workers, False))
+        print(f"   - {format_probe(probe)}")
+        worker_probes.append(probe)
+        if "error" in probe:
+            continue
+        if best is None or probe["images_per_second"] > best["images_per_second"] * (1 + AUTOTUNE_MIN_GAIN):
+            best = probe
+    if best is None:
+        raise RuntimeError(f"Не удалось выполнить шаг обучения с batch {best_batch}: {worker_probes[0]['error']}")
+
+    return {
+        "device": device,
+        "img_size": img_size,
+        "memory_budget": memory_budget,
+        "batch": best["batch"],
+        "workers": best["workers"],
+        "images_per_second": best["images_per_second"],
+        "batch_probes": batch_probes,
+        "worker_probes": worker_probes,
+    }
+
+
+def save_autotune(result, model_dir):
+    path = os.path.join(model_dir, AUTOTUNE_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=4)
+    return path
@@ -0,0 +1 @@
+"""Бенчмарки скриптов подготовки датасетов на синтетических данных"""
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from functools import partial
+
+import dataset_former
+import datasets_json_former
+from annotation_index import update_index, make_index_filter
+from benchmarks.synthetic import LAYOUTS, generate_source_tree
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарки сканирования, сопоставления, фильтрации и копирования на синтетических датасетах"
+    )
+
+    parser.add_argument("--images", type=int, default=2000, help="Число изображений в каждом датасете")
+    parser.add_argument("--density", type=int, default=3, help="Среднее число объектов в аннотации")
+    parser.add_argument("--empty-part", type=float, default=0.1, help="Доля пустых аннотаций")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[640, 480], help="Размер изображений (ширина высота)")
+    parser.add_argument("--layouts", type=str, default=",".join(LAYOUTS), help="Структуры датасетов через запятую")
+    parser.add_argument("--workers", type=int, default=4, help="Число потоков для бенчмарка объединения")
+    parser.add_argument("--repeat", type=int, default=3, help="Число повторов каждого бенчмарка")
+    parser.add_argument("--workdir", type=str, default=None, help="Рабочая папка (по умолчанию временная)")
+    parser.add_argument("--keep", action="store_true", help="Не удалять сгенерированные данные")
+    parser.add_argument("--output", type=str, default=None, help="Путь для сохранения результатов в JSON")
+
+    return parser.parse_args()
+
+
+def tree_size(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+
+def measure(fn, repeat, setup=None):
+    """Медиана времени выполнения fn() за repeat запусков (setup() вызывается перед каждым запуском)"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def report(results, name, seconds, files, size_bytes=None):
+    """Строка результата; size_bytes=None - бенчмарк читает только метаданные файлов, МБ/с не считается"""
+    results.append({
+        "benchmark": name,
+        "seconds": round(seconds, 4),
+        "files": files,
+        "files_per_s": round(files / seconds, 1) if seconds else None,
+        "mb_per_s": round(size_bytes / 1024 ** 2 / seconds, 1) if seconds and size_bytes is not None else None,
+    })
+    row = results[-1]
+    print(f"{name:<24} {row['seconds']:>9.3f} с {row['files_per_s']:>12} файл/с {row['mb_per_s'] if row['mb_per_s'] is not None else '-':>9} МБ/с")
+
+
+def main():
+    args = parse_args()
+    layouts = [layout.strip() for layout in args.layouts.split(",") if layout.strip()]
+
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix="dataset_bench_")
+    source_dir = os.path.join(workdir, "source")
+    target_dir = os.path.join(workdir, "merged")
+
+    print(f"[INFO] Генерация {args.images} изображений для структур {layouts} в {source_dir}")
+    datasets_info = generate_source_tree(
+        source_dir, args.images, layouts=layouts, density=args.density,
+        empty_part=args.empty_part, image_size=tuple(args.image_size)
+    )
+    matching = list(datasets_info.items())
+    selected_classes = ["helmet", "vest"]
+    class_names_map = {cls: cls for info in datasets_info.values() for cls in info["classes"]}
+
+    label_paths, image_paths = [], []
+    for _, _, image_src, label_src in dataset_former.iter_split_pairs(matching, source_dir, False):
+        label_paths.append(label_src)
+        image_paths.append(image_src)
+    labels_bytes = tree_size(label_paths)
+    images_bytes = tree_size(image_paths)
+    n_pairs = len(label_paths)
+
+    results = []
+    print("\n" + "=" * 70)
+    print(f"Пар: {n_pairs}, аннотации: {labels_bytes / 1024 ** 2:.1f} МБ, изображения: {images_bytes / 1024 ** 2:.1f} МБ")
+    print("Файловый кэш ОС не сбрасывается: результаты соответствуют повторным запускам")
+    print("=" * 70)
+
+    # Сканирование (datasets_json_former.process_dataset)
+    def scan():
+        for name in datasets_info:
+            datasets_json_former.process_dataset(os.path.join(source_dir, name), name)
+    seconds, _ = measure(scan, args.repeat)
+    report(results, "scan", seconds, 2 * n_pairs)
+
+    # Сопоставление изображений и аннотаций
+    seconds, _ = measure(lambda: sum(1 for _ in dataset_former.iter_split_pairs(matching, source_dir, False)), args.repeat)
+    report(results, "pairing", seconds, n_pairs)
+
+    # Фильтрация по тексту аннотаций
+    remaps = {
+        name: dataset_former.build_class_remap(info["classes"], class_names_map, selected_classes)
+        for name, info in matching
+    }
+    label_datasets = [os.path.relpath(p, source_dir).split(os.sep)[0] for p in label_paths]
+
+    def filter_text():
+        for dataset_name, label_src in zip(label_datasets, label_paths):
+            dataset_former.read_filtered_label(label_src, remaps[dataset_name])
+    seconds, _ = measure(filter_text, args.repeat)
+    report(results, "filter_text", seconds, n_pairs, labels_bytes)
+
+    # Построение индекса аннотаций и фильтрация по индексу
+    def build_indexes():
+        indexes = {}
+        for name, info in matching:
+            dataset_path = os.path.join(source_dir, name)
+            label_dirs = [lbl for _, lbl in dataset_former.find_dataset_paths(dataset_path, info["structure"])]
+            indexes[name] = update_index(dataset_path, label_dirs)[0]
+        return indexes
+    seconds, indexes = measure(build_indexes, args.repeat)
+    report(results, "index_build", seconds, n_pairs, labels_bytes)
+
+    # Проверка неизмененного индекса (как refresh_index при каждом запуске --use-index)
+    def refresh_indexes():
+        for name, info in matching:
+            dataset_path = os.path.join(source_dir, name)
+            label_dirs = [lbl for _, lbl in dataset_former.find_dataset_paths(dataset_path, info["structure"])]
+            update_index(dataset_path, label_dirs, indexes[name])
+    seconds, _ = measure(refresh_indexes, args.repeat)
+    report(results, "index_refresh", seconds, n_pairs)
+
+    # Фильтрация по индексу вместе с построением функций фильтрации
+    def filter_index():
+        index_filters = {
+            name: make_index_filter(
+                indexes[name], os.path.join(source_dir, name), remaps[name],
+                partial(dataset_former.read_filtered_label, remap=remaps[name])
+            )
+            for name, _ in matching
+        }
+        return [index_filters[dataset_name](label_src) for dataset_name, label_src in zip(label_datasets, label_paths)]
+    seconds, index_lines = measure(filter_index, args.repeat)
+    report(results, "filter_index", seconds, n_pairs, labels_bytes)
+
+    text_lines = [
+        dataset_former.read_filtered_label(label_src, remaps[dataset_name])
+        for dataset_name, label_src in zip(label_datasets, label_paths)
+    ]
+    if index_lines != text_lines:
+        print("[WARNING] Результат фильтрации по индексу отличается от фильтрации по тексту")
+
+    # Копирование изображений
+    copy_dir = os.path.join(workdir, "copy")
+
+    def reset_copy_dir():
+        shutil.rmtree(copy_dir, ignore_errors=True)
+        os.makedirs(copy_dir)
+
+    def copy_images():
+        for i, image_src in enumerate(image_paths):
+            shutil.copy2(image_src, os.path.join(copy_dir, f"{i}.jpg"))
+    seconds, _ = measure(copy_images, args.repeat, setup=reset_copy_dir)
+    report(results, "copy", seconds, n_pairs, images_bytes)
+
+    # Полное объединение (фильтрация + копирование) последовательно и в пуле потоков
+    filters = {name: partial(dataset_former.read_filtered_label, remap=remaps[name]) for name, _ in matching}
+
+    def reset_target_dir():
+        shutil.rmtree(target_dir, ignore_errors=True)
+        for split in ["train", "valid", "test"]:
+            dataset_former.safe_mkdir(os.path.join(target_dir, split, "images"))
+            dataset_former.safe_mkdir(os.path.join(target_dir, split, "labels"))
+
+    for workers in sorted({1, args.workers}):
+        def merge():
+            pairs = dataset_former.iter_split_pairs(matching, source_dir, False)
+            return dataset_former.merge_pairs(pairs, filters, target_dir, workers)
+        seconds, (_, copied) = measure(merge, args.repeat, setup=reset_target_dir)
+        report(results, f"merge_workers_{workers}", seconds, n_pairs, images_bytes * copied / max(1, n_pairs))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "pairs": n_pairs, "results": results}, f, ensure_ascii=False, indent=4)
+        print(f"\n[OK] Результаты сохранены в {args.output}")
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import os
+import io
+import json
+import random
+from PIL import Image
+
+
+LAYOUTS = ["split", "flat", "nested_split", "darknet"]
+CLASS_NAMES = ["helmet", "no_helmet", "vest", "gloves", "goggles", "boots", "person", "mask"]
+
+
+def make_image_bytes(width, height, seed=0):
+    """JPEG с шумом заданного размера (шум не дает JPEG сжаться до нескольких байт)"""
+    noise = Image.effect_noise((max(1, width // 8), max(1, height // 8)), 64 + seed % 64)
+    buffer = io.BytesIO()
+    noise.convert("RGB").resize((width, height)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def write_label(path, rng, n_classes, density, empty_part):
+    if rng.random() < empty_part:
+        boxes = 0
+    else:
+        boxes = rng.randint(1, max(1, 2 * density - 1))
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(boxes):
+            w, h = rng.uniform(0.02, 0.5), rng.uniform(0.02, 0.5)
+            x, y = rng.uniform(w / 2, 1 - w / 2), rng.uniform(h / 2, 1 - h / 2)
+            f.write(f"{rng.randrange(n_classes)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n")
+
+
+def layout_dirs(dataset_path, layout):
+    """Пары (каталог изображений, каталог аннотаций) и доли файлов для структуры датасета"""
+    if layout == "split":
+        return [
+            (os.path.join(dataset_path, s, "images"), os.path.join(dataset_path, s, "labels"), part)
+            for s, part in (("train", 0.8), ("val", 0.1), ("test", 0.1))
+        ]
+    if layout == "flat":
+        return [(os.path.join(dataset_path, "images"), os.path.join(dataset_path, "labels"), 1.0)]
+    if layout == "nested_split":
+        return [
+            (os.path.join(dataset_path, "images", s), os.path.join(dataset_path, "labels", s), part)
+            for s, part in (("train", 0.8), ("val", 0.2))
+        ]
+    if layout == "darknet":
+        obj_train_data = os.path.join(dataset_path, "obj_train_data")
+        return [(obj_train_data, obj_train_data, 1.0)]
+    raise ValueError(f"Неизвестная структура: {layout}")
+
+
+def generate_dataset(dataset_path, layout, n_images, n_classes=4, density=3, empty_part=0.1,
+                     image_size=(640, 480), seed=0):
+    """
+    Синтетический датасет в одной из структур, которые понимает find_dataset_paths().
+    density - среднее число объектов в аннотации, empty_part - доля пустых аннотаций.
+    """
+    rng = random.Random(seed)
+    image_bytes = make_image_bytes(*image_size, seed=seed)
+    classes = CLASS_NAMES[:n_classes]
+
+    counter = 0
+    dirs = layout_dirs(dataset_path, layout)
+    for i, (images_dir, labels_dir, part) in enumerate(dirs):
+        os.makedirs(images_dir, exist_ok=True)
+        os.makedirs(labels_dir, exist_ok=True)
+        count = n_images - counter if i == len(dirs) - 1 else int(n_images * part)
+        for _ in range(count):
+            stem = f"img_{counter:07d}"
+            with open(os.path.join(images_dir, stem + ".jpg"), "wb") as f:
+                f.write(image_bytes)
+            write_label(os.path.join(labels_dir, stem + ".txt"), rng, n_classes, density, empty_part)
+            counter += 1
+
+    if layout == "darknet":
+        with open(os.path.join(dataset_path, "obj.names"), "w", encoding="utf-8") as f:
+            f.write("\n".join(classes) + "\n")
+        with open(os.path.join(dataset_path, "obj.data"), "w", encoding="utf-8") as f:
+            f.write(f"classes = {n_classes}\n")
+    else:
+        with open(os.path.join(dataset_path, "data.yaml"), "w", encoding="utf-8") as f:
+            f.write(f"nc: {n_classes}\nnames: {classes}\n")
+
+    return {"classes": {name: idx for idx, name in enumerate(classes)}, "structure": layout}
+
+
+def generate_source_tree(root, n_images, layouts=LAYOUTS, **kwargs):
+    """
+    Каталог с одним датасетом каждой структуры, datasets_info.json и class_names.json.
+    Возвращает содержимое datasets_info.json.
+    """
+    os.makedirs(root, exist_ok=True)
+    datasets_info = {}
+    for seed, layout in enumerate(layouts):
+        name = f"synthetic_{layout}"
+        info = generate_dataset(os.path.join(root, name), layout, n_images, seed=seed, **kwargs)
+        info["elements_count"] = {"images": n_images, "labels": n_images}
+        datasets_info[name] = info
+
+    class_names = {cls: cls for info in datasets_info.values() for cls in info["classes"]}
+    with open(os.path.join(root, "datasets_info.json"), "w", encoding="utf-8") as f:
+        json.dump(datasets_info, f, ensure_ascii=False, indent=4)
+    with open(os.path.join(root, "class_names.json"), "w", encoding="utf-8") as f:
+        json.dump(class_names, f, ensure_ascii=False, indent=4)
+    return datasets_info
@@ -1,9 +1,21 @@
 import os
+import io
 import json
+import hashlib
 import shutil
+import time
 import random
 import argparse
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from PIL import Image, ImageOps
 from tqdm import tqdm
+from annotation_index import INDEX_DIR_NAME, refresh_index, make_index_filter
+from shard_io import ShardWriter
+from image_dedup import image_dhash, new_dedup_index, find_duplicate, add_to_index, save_dedup_report
+from stage_stats import STAGE_REPORT_FILE, StageStats, measure, profiled
+from image_probe import IMAGE_INDEX_DIR_NAME, SKIP_STATUSES, load_image_index, refresh_image_index, image_records
 
 
 BASE_DIR = "/media/user/Data/IndustrialSafety/Datasets"
@@ -16,6 +28,26 @@ TRAIN_PART = 0.8  # 80%
 VAL_PART = 0.1    # 10%
 TEST_PART = 0.1   # 10%
 RANDOM_SEED = random.seed(12345)
+SPLIT_MODES = ["random", "hash", "stratified"]
+SPLIT_MODE = "random"
+SPLIT_PARTS = {"train": TRAIN_PART, "valid": VAL_PART, "test": TEST_PART}
+WORKERS = 1
+PENDING_PER_WORKER = 4  # Ограничение числа задач в очереди на одного потока
+IMAGE_EXTS = [".jpg", ".jpeg", ".png", ".bmp", ".webp"]  # В порядке приоритета при совпадении имен
+MATERIALIZE_MODES = ["copy", "hardlink", "reflink", "symlink"]
+MATERIALIZE_MODE = "copy"
+VIRTUAL_CACHE_DIR = "labels_cache"  # Каталог с аннотациями в режиме --virtual
+MERGE_MANIFEST_FILE = "merge_manifest.json"
+SHARDS_DIR = "shards"
+RESIZE_FORMATS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}
+RESIZE_QUALITY = 90
+PLAN_COPY_MB_PER_S = 100  # Оценочная скорость копирования (HDD) для --plan
+PLAN_FILE_OVERHEAD_S = 0.002  # Оценочные накладные расходы на одну пару файлов для --plan
+DEDUP_ACTIONS = ["drop", "group"]
+DEDUP_ACTION = "drop"
+DEDUP_REPORT_FILE = "dedup_report.json"
+IMAGE_SIZES_FILE = "image_sizes.json"
+FICLONE = 0x40049409  # ioctl для reflink-копирования (Linux: btrfs, xfs)
 
 
 def safe_mkdir(path):
@@ -47,7 +79,7 @@ def find_dataset_paths(dataset_path, structure, arg=False):
     return paths
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         description="Объединение и фильтрация датасетов по выбранным классам"
     )
@@ -86,17 +118,146 @@ def parse_args():
         help="Исключить тестовые данные из выбранных датасетов"
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Количество потоков для фильтрации и копирования (если не указано, используется значение WORKERS)"
+    )
 
+    parser.add_argument(
+        "--materialize",
+        type=str,
+        choices=MATERIALIZE_MODES,
+        default=None,
+        help="Способ размещения изображений: copy, hardlink, reflink или symlink "
+             "(если не указан, используется значение MATERIALIZE_MODE)"
+    )
 
-def filter_label_file(src_label_path, dst_label_path, class_map, class_names_map, selected_classes):
-    id_to_normalized = {}
+    parser.add_argument(
+        "--virtual",
+        action="store_true",
+        help="Не копировать изображения: записать только аннотации, списки изображений "
+             "train.txt/valid.txt/test.txt и data.yaml, ссылающиеся на исходные файлы"
+    )
+
+    parser.add_argument(
+        "--use-index",
+        action="store_true",
+        help="Фильтровать аннотации по индексу annotation_index (создается datasets_json_former.py --build-index), "
+             "повторно читаются только измененные файлы"
+    )
+
+    parser.add_argument(
+        "--use-image-index",
+        action="store_true",
+        help="Пропускать нечитаемые и слишком маленькие изображения по индексу image_index (создается "
+             "datasets_json_former.py --probe-images, измененные файлы проверяются заново, с --plan используется "
+             "только сохраненный индекс) и записать размеры изображений в image_sizes.json"
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Инкрементальное обновление: обрабатывать только новые и измененные пары "
+             "(по манифесту merge_manifest.json), удалять файлы с отсутствующими источниками"
+    )
+
+    parser.add_argument(
+        "--split-mode",
+        type=str,
+        choices=SPLIT_MODES,
+        default=None,
+        help="Способ разделения на train/valid/test: random (перемешивание каталога), "
+             "hash (по хэшу имени датасета и файла), stratified (с учетом состава классов) "
+             "(если не указан, используется значение SPLIT_MODE)"
+    )
+
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help="Записать изображения и аннотации в tar-шарды (shards/<split>/NNNNN.tar + index.json) "
+             "вместо отдельных файлов"
+    )
+
+    parser.add_argument(
+        "--resize-to",
+        type=int,
+        default=None,
+        help="Уменьшить изображения так, чтобы длинная сторона не превышала заданного размера "
+             "(например, 640 - размер обучения). Аннотации YOLO нормированы и не меняются"
+    )
+
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=list(RESIZE_FORMATS),
+        default=None,
+        help="Формат изображений при --resize-to (если не указан, сохраняется исходный формат)"
+    )
+
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=None,
+        help="Качество JPEG/WebP при --resize-to (если не указано, используется значение RESIZE_QUALITY)"
+    )
+
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Только оценить результат объединения (число изображений и объектов, объем, время) "
+             "без чтения и копирования изображений. Если для всех датасетов в datasets_info.json есть "
+             "статистика (datasets_json_former.py --stats), аннотации не читаются"
+    )
+
+    parser.add_argument(
+        "--plan-exact",
+        action="store_true",
+        help="В режиме --plan всегда фильтровать аннотации (оценка по split выходного датасета), "
+             "даже если есть статистика в datasets_info.json"
+    )
+
+    parser.add_argument(
+        "--dedup-threshold",
+        type=int,
+        default=None,
+        help="Искать почти одинаковые изображения по перцептивному хэшу с расстоянием Хэмминга "
+             "не больше заданного (из 64 бит, например 4). Если не указан, поиск не выполняется"
+    )
+
+    parser.add_argument(
+        "--dedup-action",
+        type=str,
+        choices=DEDUP_ACTIONS,
+        default=None,
+        help="Что делать с дубликатами: drop - не включать в датасет, group - помещать в тот же split, "
+             "что и первое изображение (если не указано, используется значение DEDUP_ACTION)"
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Сохранить профиль выполнения cProfile в указанный файл (просмотр: python -m pstats <файл>)"
+    )
+
+    return parser.parse_args(argv)
+
+
+def build_class_remap(class_map, class_names_map, selected_classes):
+    """Соответствие исходного id класса новому id среди выбранных классов"""
+    new_id_map = {cls: i for i, cls in enumerate(selected_classes)}
+    remap = {}
     for name, idx in class_map.items():
         normalized = class_names_map.get(name, name)
-        id_to_normalized[idx] = normalized
+        if normalized in new_id_map:
+            remap[idx] = str(new_id_map[normalized])
+    return remap
 
-    new_id_map = {cls: i for i, cls in enumerate(selected_classes)}
 
+def read_filtered_label(src_label_path, remap):
+    """Чтение аннотаций с оставлением только выбранных классов (с новыми id)"""
     filtered_lines = []
 
     with open(src_label_path, "r", encoding="utf-8") as f:
@@ -111,22 +272,706 @@ def filter_label_file(src_label_path, dst_label_path, class_map, class_names_map
         except ValueError:
             continue
 
-        normalized_name = id_to_normalized.get(class_id)
-        if normalized_name in selected_classes:
-            new_id = new_id_map[normalized_name]
-            parts[0] = str(new_id)
+        new_id = remap.get(class_id)
+        if new_id is not None:
+            parts[0] = new_id
             filtered_lines.append(" ".join(parts) + "\n")
 
+    return filtered_lines
+
+
+def write_label_file(dst_label_path, lines):
+    with open(dst_label_path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+
+
+def filter_label_file(src_label_path, dst_label_path, class_map, class_names_map, selected_classes):
+    remap = build_class_remap(class_map, class_names_map, selected_classes)
+    filtered_lines = read_filtered_label(src_label_path, remap)
+
     if filtered_lines:
-        with open(dst_label_path, "w", encoding="utf-8") as f:
-            f.writelines(filtered_lines)
+        write_label_file(dst_label_path, filtered_lines)
         return True
     return False
 
 
-def main():
-    args = parse_args()
-    
+def scan_pair_dirs(images_path, labels_path):
+    """
+    Один проход os.scandir по каталогам изображений и аннотаций.
+    Возвращает (список имен .txt файлов, индекс {имя без расширения: путь к изображению}).
+    Расширения изображений сравниваются без учета регистра.
+    """
+    ext_priority = {ext: i for i, ext in enumerate(IMAGE_EXTS)}
+    label_files = []
+    images = {}
+
+    with os.scandir(images_path) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            priority = ext_priority.get(ext.lower())
+            if priority is not None:
+                current = images.get(stem)
+                if current is None or priority < current[0]:
+                    images[stem] = (priority, entry.path)
+            elif labels_path == images_path and ext == ".txt":
+                label_files.append(entry.name)
+
+    if labels_path != images_path:
+        with os.scandir(labels_path) as it:
+            label_files = [entry.name for entry in it if entry.name.endswith(".txt")]
+
+    return label_files, {stem: path for stem, (_, path) in images.items()}
+
+
+def split_hash(dataset_name, rel_path):
+    """Стабильный хэш имени датасета и пути к файлу без расширения, приведенный к [0, 1)"""
+    key = f"{dataset_name}/{os.path.splitext(rel_path)[0]}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") / 2 ** 64
+
+
+def hash_split(dataset_name, rel_path):
+    """Split по стабильному хэшу имени датасета и пути к файлу без расширения"""
+    value = split_hash(dataset_name, rel_path)
+    if value < TRAIN_PART:
+        return "train"
+    if value < TRAIN_PART + VAL_PART:
+        return "valid"
+    return "test"
+
+
+def stratified_split_pairs(pairs, label_filters, source_dir, workers, merge_manifest=None):
+    """
+    Выбор split по составу классов аннотации (режим stratified).
+    Аннотации всех пар предварительно фильтруются (в пуле потоков), и пары группируются по набору
+    выбранных классов. Внутри группы пары сортируются по split_hash() и по очереди направляются
+    в split с наибольшим отставанием от целевой доли, поэтому редкие классы распределяются
+    по train/valid/test в заданных пропорциях, а результат не зависит от порядка обхода каталогов и --workers.
+    Пары из манифеста прошлого объединения (--incremental) сохраняют свой split и учитываются в счетчиках групп.
+    Пары без выбранных классов получают split по hash_split() (в выходной датасет они не попадают).
+    Список пар хранится в памяти целиком.
+    """
+    pairs = list(pairs)
+    old_entries = merge_manifest["entries"] if merge_manifest is not None else {}
+
+    def read_stratum(pair):
+        _, dataset_name, _, label_src = pair
+        lines = label_filters[dataset_name](label_src)
+        return tuple(sorted({line.split(maxsplit=1)[0] for line in lines})) if lines else None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        strata = list(tqdm(executor.map(read_stratum, pairs), total=len(pairs), desc="Чтение состава классов",
+                           unit="файл"))
+
+    splits = [None] * len(pairs)
+    counts = {}
+    pending = {}
+    for i, ((_, dataset_name, _, label_src), stratum) in enumerate(zip(pairs, strata)):
+        rel_path = os.path.relpath(label_src, os.path.join(source_dir, dataset_name))
+        if stratum is None:
+            splits[i] = hash_split(dataset_name, rel_path)
+            continue
+        stratum_counts = counts.setdefault(stratum, {split: 0 for split in SPLIT_PARTS})
+        entry = old_entries.get(label_src)
+        if entry is not None and entry["split"] is not None:
+            splits[i] = entry["split"]
+            stratum_counts[entry["split"]] += 1
+        else:
+            pending.setdefault(stratum, []).append((split_hash(dataset_name, rel_path), label_src, i))
+
+    for stratum, items in pending.items():
+        stratum_counts = counts[stratum]
+        for _, _, i in sorted(items):
+            total = sum(stratum_counts.values()) + 1
+            split_name = max(SPLIT_PARTS, key=lambda split: SPLIT_PARTS[split] * total - stratum_counts[split])
+            stratum_counts[split_name] += 1
+            splits[i] = split_name
+
+    for split_name, (_, dataset_name, image_src, label_src) in zip(splits, pairs):
+        yield split_name, dataset_name, image_src, label_src
+
+
+def iter_split_pairs(matching_datasets, source_dir, exclude_test, pairing_stats=None, split_mode=SPLIT_MODE,
+                     stage_stats=None):
+    """
+    Генератор пар (split, имя датасета, изображение, аннотация).
+    Каталоги читаются по одному, поэтому в памяти хранится только текущий каталог.
+    pairing_stats - словарь {имя датасета: [аннотации без изображений, изображения без аннотаций]}.
+    stage_stats - StageStats для учета времени чтения каталогов (этап scan_dirs).
+    В режиме random каталог перемешивается целиком, в режиме hash split вычисляется
+    для каждой пары отдельно, в режиме stratified split = None (выбирается в stratified_split_pairs()).
+    """
+    for dataset_name, info in matching_datasets:
+        dataset_path = os.path.join(source_dir, dataset_name)
+        for images_path, labels_path in find_dataset_paths(dataset_path, info["structure"], exclude_test):
+
+            with measure(stage_stats, "scan_dirs", dataset_name) as record:
+                label_files, images = scan_pair_dirs(images_path, labels_path)
+                record["files"] = len(label_files) + len(images)
+            pairs = []
+            for label_file in label_files:
+                candidate = images.pop(os.path.splitext(label_file)[0], None)
+                if candidate is not None:
+                    pairs.append((candidate, os.path.join(labels_path, label_file)))
+
+            if pairing_stats is not None:
+                stats = pairing_stats.setdefault(dataset_name, [0, 0])
+                stats[0] += len(label_files) - len(pairs)
+                stats[1] += len(images)
+
+            if split_mode != "random":
+                for image_src, label_src in pairs:
+                    if split_mode == "hash":
+                        split_name = hash_split(dataset_name, os.path.relpath(label_src, dataset_path))
+                    else:
+                        split_name = None
+                    yield split_name, dataset_name, image_src, label_src
+                continue
+
+            if not pairs:
+                continue
+
+            random.shuffle(pairs)
+            n = len(pairs)
+            train_split = pairs[:int(n * TRAIN_PART)]
+            val_split = pairs[int(n * TRAIN_PART):int(n * (TRAIN_PART + VAL_PART))]
+            test_split = pairs[int(n * (VAL_PART + TRAIN_PART)):]
+
+            splits_data = {"train": train_split, "valid": val_split, "test": test_split}
+
+            for split_name, split_pairs in splits_data.items():
+                for image_src, label_src in split_pairs:
+                    yield split_name, dataset_name, image_src, label_src
+
+
+def skip_corrupt_pairs(pairs, image_info, skipped):
+    """
+    Пропуск пар с изображениями, которые Ultralytics не загрузит (статусы SKIP_STATUSES), по индексу изображений.
+    JPEG без маркера конца (truncated) не пропускаются - Ultralytics восстанавливает их при проверке датасета.
+    Split назначается до пропуска, поэтому остальные пары попадают в те же split, что и без проверки.
+    skipped - Counter {(имя датасета, статус): число пар} (в том числе непропущенных truncated).
+    """
+    for split_name, dataset_name, image_src, label_src in pairs:
+        record = image_info.get(image_src)
+        if record is not None and record[0] != "ok":
+            skipped[(dataset_name, record[0])] += 1
+            if record[0] in SKIP_STATUSES:
+                continue
+        yield split_name, dataset_name, image_src, label_src
+
+
+_fallback_warned = set()
+
+
+def remove_existing(path):
+    """
+    Удаление файла или ссылки по пути path перед записью: файл, оставшийся от объединения
+    с --materialize hardlink/symlink, - ссылка на исходное изображение, и запись в него
+    изменила бы исходный датасет.
+    """
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def reflink_file(src, dst):
+    import fcntl
+
+    with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def materialize_file(src, dst, mode):
+    """
+    Размещение изображения в выходном датасете без копирования данных (если возможно).
+    При ошибке (разные файловые системы, неподдерживаемая ФС) выполняется обычное копирование.
+    Возвращает фактически использованный способ.
+    """
+    remove_existing(dst)
+    if mode == "copy":
+        shutil.copy2(src, dst)
+        return "copy"
+
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+        elif mode == "reflink":
+            reflink_file(src, dst)
+        elif mode == "symlink":
+            os.symlink(os.path.abspath(src), dst)
+        else:
+            raise ValueError(f"Неизвестный способ размещения: {mode}")
+    except (OSError, ImportError) as e:
+        if mode not in _fallback_warned:
+            _fallback_warned.add(mode)
+            reason = getattr(e, "strerror", None) or e
+            print(f"\n[WARNING] Не удалось выполнить {mode} ({reason}), используется копирование")
+        remove_existing(dst)
+        shutil.copy2(src, dst)
+        return "copy"
+    return mode
+
+
+def resized_image_ext(image_src, resize):
+    if resize and resize["format"]:
+        return RESIZE_FORMATS[resize["format"]]
+    return os.path.splitext(image_src)[1]
+
+
+def resized_size(w, h, resize):
+    """Размер изображения после --resize-to (w, h - размер с учетом ориентации EXIF)"""
+    r = resize["max_side"] / max(w, h)
+    if r >= 1:
+        return w, h
+    return max(1, round(w * r)), max(1, round(h * r))
+
+
+def transcode_image(image_src, resize):
+    """
+    Уменьшение изображения до resize["max_side"] по длинной стороне (без увеличения)
+    и кодирование в формат resize["format"] (или исходный). Ориентация из EXIF
+    применяется к пикселям, так как cv2.imread в Ultralytics тоже ее учитывает.
+    Итоговый размер всегда равен resized_size() от исходного размера.
+    Возвращает байты закодированного изображения.
+    """
+    ext = resized_image_ext(image_src, resize).lower()
+    fmt = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".bmp": "BMP", ".webp": "WEBP"}[ext]
+
+    with Image.open(image_src) as img:
+        w, h = img.size
+        orientation = img.getexif().get(0x0112, 1)
+        target = resized_size(*((h, w) if orientation in (5, 6, 7, 8) else (w, h)), resize)
+        if target == (w, h) and img.format == fmt and orientation == 1:
+            # Изображение уже нужного размера и формата - перекодирование не требуется
+            with open(image_src, "rb") as f:
+                return f.read()
+        if max(target) < max(w, h):
+            # Для JPEG декодирование сразу в уменьшенном масштабе (DCT scaling)
+            img.draft("RGB", (w * max(target) // max(w, h), h * max(target) // max(w, h)))
+        img = ImageOps.exif_transpose(img)
+        if img.size != target:
+            img = img.resize(target, Image.BILINEAR)
+        if fmt == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+
+        buffer = io.BytesIO()
+        if fmt in ("JPEG", "WEBP"):
+            img.save(buffer, fmt, quality=resize["quality"])
+        else:
+            img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def copy_pair(image_src, image_dst, label_dst, lines, materialize=MATERIALIZE_MODE, resize=None,
+              stage_stats=None, dataset_name=None):
+    with measure(stage_stats, "write_label", dataset_name) as record:
+        write_label_file(label_dst, lines)
+        record["bytes"] = sum(len(line) for line in lines)
+
+    if resize:
+        with measure(stage_stats, "resize_image", dataset_name) as record:
+            image_data = transcode_image(image_src, resize)
+            remove_existing(image_dst)
+            with open(image_dst, "wb") as f:
+                f.write(image_data)
+            record["bytes"] = len(image_data)
+        return "resize"
+
+    start = time.perf_counter()
+    used_mode = materialize_file(image_src, image_dst, materialize)
+    if stage_stats is not None:
+        # Байты учитываются только при фактическом копировании данных
+        nbytes = os.path.getsize(image_src) if used_mode == "copy" else 0
+        stage_stats.add(f"{used_mode}_image", dataset_name, time.perf_counter() - start, nbytes)
+    return used_mode
+
+
+def file_signatures(image_path, label_path):
+    """Размер и mtime изображения и аннотации"""
+    image_st = os.stat(image_path)
+    label_st = os.stat(label_path)
+    return [image_st.st_size, image_st.st_mtime_ns, label_st.st_size, label_st.st_mtime_ns]
+
+
+def new_merge_manifest(selected_classes, layout):
+    return {"classes": selected_classes, "layout": layout, "image_counter": 0, "entries": {}}
+
+
+def load_merge_manifest(manifest_path, selected_classes, layout):
+    """
+    Загрузка манифеста предыдущего объединения.
+    Если манифест создан для других классов или другого способа размещения,
+    его выходные файлы удаляются и объединение выполняется заново.
+    """
+    if not os.path.exists(manifest_path):
+        return new_merge_manifest(selected_classes, layout)
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            merge_manifest = json.load(f)
+    except Exception as e:
+        print(f"[WARNING] Не удалось прочитать манифест {manifest_path}: {e}")
+        return new_merge_manifest(selected_classes, layout)
+
+    if merge_manifest.get("classes") != selected_classes or merge_manifest.get("layout") != layout:
+        print("[WARNING] Манифест создан для других классов или режима, датасет будет собран заново")
+        remove_entry_outputs(os.path.dirname(manifest_path), merge_manifest.get("entries", {}).values())
+        return new_merge_manifest(selected_classes, layout)
+
+    return merge_manifest
+
+
+def save_merge_manifest(manifest_path, merge_manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(merge_manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def remove_entry_outputs(target_dir, entries):
+    removed = 0
+    for entry in entries:
+        for key in ("image_out", "label_out"):
+            if entry.get(key) and os.path.lexists(os.path.join(target_dir, entry[key])):
+                os.remove(os.path.join(target_dir, entry[key]))
+                removed += 1
+    return removed
+
+
+def prepare_pair(label_filter, label_src, image_src, dedup=False, resize=None, inline_image=False,
+                 stage_stats=None, dataset_name=None):
+    """
+    Работа над парой в потоке пула: фильтрация аннотации и (если пара не отброшена)
+    перцептивный хэш изображения и уменьшенное изображение для записи в шард.
+    Возвращает (строки аннотации, хэш или None, байты изображения или None).
+    """
+    with measure(stage_stats, "read_label", dataset_name) as record:
+        lines = label_filter(label_src)
+        if stage_stats is not None:
+            record["bytes"] = os.path.getsize(label_src)
+    if not lines:
+        return lines, None, None
+
+    phash = None
+    if dedup:
+        with measure(stage_stats, "hash_image", dataset_name):
+            phash = image_dhash(image_src)
+
+    image_data = None
+    if resize and inline_image:
+        with measure(stage_stats, "resize_image", dataset_name) as record:
+            image_data = transcode_image(image_src, resize)
+            record["bytes"] = len(image_data)
+    return lines, phash, image_data
+
+
+def merge_pairs(pairs, label_filters, target_dir, workers, materialize=MATERIALIZE_MODE, manifests=None,
+                merge_manifest=None, manifest_dir=None,
+                dedup_index=None, dedup_action=DEDUP_ACTION, dedup_pairs=None, shard_writers=None, resize=None,
+                stage_stats=None, image_info=None, output_sizes=None):
+    """
+    Фильтрация и копирование пар в пуле потоков.
+    Результаты фильтрации забираются в порядке поступления пар, поэтому
+    нумерация image_counter не зависит от числа потоков.
+    label_filters - словарь {имя датасета: функция(путь к аннотации) -> отфильтрованные строки}.
+    manifests - словарь {split: открытый файл}, в который записываются пути к изображениям.
+    merge_manifest - манифест предыдущего объединения (--incremental): неизмененные пары
+    пропускаются, измененные сохраняют split и имя. Пути в манифесте задаются относительно manifest_dir.
+    dedup_index - индекс перцептивных хэшей (--dedup-threshold): дубликаты ранее принятых изображений
+    отбрасываются (drop) или помещаются в тот же split (group); число дубликатов по парам
+    датасетов накапливается в dedup_pairs.
+    shard_writers - словарь {split: ShardWriter}: пары записываются в шарды в основном потоке
+    (порядок записи совпадает с нумерацией), параллельно выполняются фильтрация и уменьшение изображений.
+    resize - параметры уменьшения изображений {"max_side", "format", "quality"} (--resize-to).
+    stage_stats - StageStats для учета времени и объема чтения, записи и копирования по датасетам.
+    image_info - {путь к изображению: (статус, ширина, высота)} из индекса изображений: размеры
+    изображений выходного датасета (после --resize-to) записываются в output_sizes по путям
+    относительно manifest_dir (или target_dir).
+    Возвращает (число обработанных аннотаций, число пар в выходном датасете).
+    """
+    max_pending = max(1, workers) * PENDING_PER_WORKER
+    processed = 0
+    emitted = 0
+    reused = 0
+    image_counter = merge_manifest["image_counter"] if merge_manifest is not None else 0
+    old_entries = merge_manifest["entries"] if merge_manifest is not None else {}
+    new_entries = {}
+
+    def write_manifest_line(split_name, image_dst):
+        if manifests is not None:
+            manifest = manifests[split_name]
+            manifest.write("./" + os.path.relpath(image_dst, os.path.dirname(manifest.name)) + "\n")
+
+    def record_size(image_src, image_dst):
+        record = image_info.get(image_src) if output_sizes is not None else None
+        if record is not None:
+            size = resized_size(record[1], record[2], resize) if resize else (record[1], record[2])
+            output_sizes[os.path.relpath(image_dst, manifest_dir or target_dir)] = list(size)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor, \
+            tqdm(desc="Обработка датасетов", unit="файл") as pbar:
+        pending = deque()
+        copies = deque()
+
+        def submit_filter(dataset_name, image_src, label_src):
+            return executor.submit(
+                prepare_pair, label_filters[dataset_name], label_src, image_src,
+                dedup_index is not None, resize, shard_writers is not None, stage_stats, dataset_name
+            )
+
+        def collect():
+            nonlocal processed, emitted, reused, image_counter
+            split_name, dataset_name, image_src, label_src, future, entry = pending.popleft()
+            processed += 1
+            pbar.update(1)
+
+            if future is None:
+                # Пара не изменилась с прошлого объединения
+                new_entries[label_src] = entry
+                reused += 1
+                if entry["name"]:
+                    if dedup_index is not None and entry.get("phash") is not None:
+                        add_to_index(dedup_index, entry["phash"], (dataset_name, entry["split"]))
+                    emitted += 1
+                    write_manifest_line(entry["split"], os.path.join(manifest_dir, entry["image_out"]))
+                    record_size(image_src, os.path.join(manifest_dir, entry["image_out"]))
+                return
+
+            lines, phash, image_data = future.result()
+            if entry is not None:
+                remove_entry_outputs(manifest_dir, [entry])
+
+            duplicate_of = None
+            if lines and phash is not None:
+                duplicate_of = find_duplicate(dedup_index, phash)
+                if duplicate_of is not None:
+                    dedup_pairs[(duplicate_of[0], dataset_name)] += 1
+                    if dedup_action == "drop":
+                        lines = None
+                    elif entry is None:
+                        split_name = duplicate_of[1]
+
+            if not lines:
+                if merge_manifest is not None:
+                    new_entries[label_src] = {
+                        "image": image_src, "signature": file_signatures(image_src, label_src),
+                        "split": split_name, "name": None,
+                    }
+                return
+
+            if phash is not None and duplicate_of is None:
+                add_to_index(dedup_index, phash, (dataset_name, split_name))
+
+            if entry is not None and entry["name"]:
+                output_name = entry["name"]
+            else:
+                output_name = f"{dataset_name}_{image_counter}"
+                image_counter += 1
+
+            image_ext = resized_image_ext(image_src, resize)
+            image_dst = os.path.join(target_dir, split_name, "images", f"{output_name}{image_ext}")
+            label_dst = os.path.join(target_dir, split_name, "labels", f"{output_name}.txt")
+            emitted += 1
+            write_manifest_line(split_name, image_dst)
+            record_size(image_src, image_dst)
+
+            if merge_manifest is not None:
+                new_entries[label_src] = {
+                    "image": image_src, "signature": file_signatures(image_src, label_src),
+                    "split": split_name, "name": output_name,
+                    "image_out": os.path.relpath(image_dst, manifest_dir),
+                    "label_out": os.path.relpath(label_dst, manifest_dir),
+                    "phash": phash,
+                }
+
+            if shard_writers is not None:
+                writer = shard_writers[split_name]
+                with measure(stage_stats, "write_shard", dataset_name) as record:
+                    label_data = "".join(lines).encode("utf-8")
+                    image_name = f"images/{output_name}{image_ext}"
+                    writer.add_bytes(f"labels/{output_name}.txt", label_data)
+                    if image_data is not None:
+                        writer.add_bytes(image_name, image_data)
+                    else:
+                        writer.add_file(image_name, image_src)
+                    record["bytes"] = len(label_data) + writer.index[image_name][2]
+                return
+
+            copies.append(executor.submit(
+                copy_pair, image_src, image_dst, label_dst, lines, materialize, resize, stage_stats, dataset_name
+            ))
+            while len(copies) > max_pending:
+                copies.popleft().result()
+
+        for split_name, dataset_name, image_src, label_src in pairs:
+            entry = old_entries.pop(label_src, None)
+            future = None
+            if entry is not None:
+                # Ранее обработанная пара сохраняет свой split
+                if entry["split"] is not None:
+                    split_name = entry["split"]
+                if entry["image"] != image_src or entry["signature"] != file_signatures(image_src, label_src):
+                    future = submit_filter(dataset_name, image_src, label_src)
+            else:
+                future = submit_filter(dataset_name, image_src, label_src)
+
+            pending.append((split_name, dataset_name, image_src, label_src, future, entry))
+            if len(pending) >= max_pending:
+                collect()
+
+        while pending:
+            collect()
+        while copies:
+            copies.popleft().result()
+
+    if merge_manifest is not None:
+        removed = remove_entry_outputs(manifest_dir, old_entries.values())
+        print(f"\n[INFO] Без изменений: {reused}, обработано заново: {processed - reused}, "
+              f"удалено файлов с отсутствующими источниками: {removed}")
+        merge_manifest["entries"] = new_entries
+        merge_manifest["image_counter"] = image_counter
+
+    return processed, emitted
+
+
+def build_label_filters(matching_datasets, source_dir, class_names_map, selected_classes, index_dir=None,
+                        stage_stats=None):
+    """Функции фильтрации аннотаций для каждого датасета (по тексту или по индексу)"""
+    label_filters = {}
+    for dataset_name, info in matching_datasets:
+        remap = build_class_remap(info["classes"], class_names_map, selected_classes)
+        text_filter = partial(read_filtered_label, remap=remap)
+        if index_dir is None:
+            label_filters[dataset_name] = text_filter
+            continue
+
+        dataset_path = os.path.join(source_dir, dataset_name)
+        label_dirs = [labels_path for _, labels_path in find_dataset_paths(dataset_path, info["structure"])]
+        with measure(stage_stats, "refresh_index", dataset_name):
+            index = refresh_index(index_dir, dataset_name, dataset_path, label_dirs)
+
+        label_filters[dataset_name] = make_index_filter(index, dataset_path, remap, text_filter)
+    return label_filters
+
+
+def load_image_info(matching_datasets, source_dir, index_dir, workers, stage_stats=None, probe=True):
+    """
+    Обновление индексов изображений датасетов и словарь {путь к изображению: (статус, ширина, высота)}.
+    probe=False (--plan) - используются только сохраненные индексы, заголовки изображений не читаются.
+    """
+    image_info = {}
+    for dataset_name, info in matching_datasets:
+        dataset_path = os.path.join(source_dir, dataset_name)
+        if not probe:
+            index = load_image_index(index_dir, dataset_name)
+            if index is None:
+                print(f"[WARNING] Нет индекса изображений {dataset_name}, поврежденные изображения в оценке не учитываются")
+                continue
+        else:
+            image_dirs = [images_path for images_path, _ in find_dataset_paths(dataset_path, info["structure"])]
+            with measure(stage_stats, "probe_images", dataset_name):
+                index = refresh_image_index(index_dir, dataset_name, dataset_path, image_dirs, IMAGE_EXTS, workers)
+        image_info.update(image_records(index, dataset_path))
+    return image_info
+
+
+def plan_merge(pairs, label_filters, selected_classes):
+    """
+    Оценка объединения без записи файлов: пары проходят тот же генератор и фильтрацию
+    аннотаций (по индексу при --use-index), для изображений используется только os.stat.
+    Возвращает {(имя датасета, split): {"images", "instances", "bytes"}}.
+    """
+    plan = {}
+    for split_name, dataset_name, image_src, label_src in pairs:
+        lines = label_filters[dataset_name](label_src)
+        if not lines:
+            continue
+
+        stats = plan.setdefault((dataset_name, split_name), {
+            "images": 0, "instances": Counter(), "bytes": 0
+        })
+        stats["images"] += 1
+        stats["bytes"] += os.stat(image_src).st_size
+        for line in lines:
+            stats["instances"][selected_classes[int(line.split(maxsplit=1)[0])]] += 1
+    return plan
+
+
+def plan_from_stats(matching_datasets, class_names_map, selected_classes, exclude_test):
+    """
+    Оценка объединения по статистике datasets_info.json без чтения аннотаций.
+    Изображение попадает в датасет, если его набор классов содержит хотя бы один выбранный класс;
+    объем берется из сохраненных размеров изображений каждого набора классов.
+    Пары без изображений не учитываются статистикой, поэтому оценка - верхняя граница.
+    Возвращает план в формате plan_merge() по split исходных датасетов
+    или None, если статистики (с объемом изображений) нет хотя бы для одного датасета.
+    """
+    for _, info in matching_datasets:
+        splits = info.get("stats", {}).get("splits", {})
+        if not splits or any("bytes" not in class_set for split in splits.values() for class_set in split["class_sets"]):
+            return None
+
+    plan = {}
+    for dataset_name, info in matching_datasets:
+        for split_name, split_stats in info["stats"]["splits"].items():
+            if exclude_test and split_name == "test":
+                continue
+            stats = {"images": 0, "instances": Counter(), "bytes": 0}
+            for class_name, class_stats in split_stats["classes"].items():
+                normalized = class_names_map.get(class_name, class_name)
+                if normalized in selected_classes:
+                    stats["instances"][normalized] += class_stats["instances"]
+            for class_set in split_stats["class_sets"]:
+                if any(class_names_map.get(cls, cls) in selected_classes for cls in class_set["classes"]):
+                    stats["images"] += class_set["images"]
+                    stats["bytes"] += class_set["bytes"]
+            plan[(dataset_name, split_name)] = stats
+    return plan
+
+
+def print_merge_plan(plan, selected_classes, workers, copies_images=True):
+    total_images = 0
+    total_bytes = 0
+    total_instances = Counter()
+
+    print("\n[PLAN] Датасет / split: изображений, объектов по классам, объем")
+    for (dataset_name, split_name), stats in sorted(plan.items()):
+        instances = ", ".join(f"{cls}: {stats['instances'][cls]}" for cls in selected_classes)
+        print(f"   - {dataset_name} / {split_name}: {stats['images']}, {instances}, "
+              f"{stats['bytes'] / 1024 ** 2:.1f} МБ")
+        total_images += stats["images"]
+        total_bytes += stats["bytes"]
+        total_instances.update(stats["instances"])
+
+    copied_bytes = total_bytes if copies_images else 0
+    estimate = (total_images * PLAN_FILE_OVERHEAD_S) / max(1, workers) + copied_bytes / (PLAN_COPY_MB_PER_S * 1024 ** 2)
+    print(f"\n[PLAN] Всего изображений: {total_images}")
+    for cls in selected_classes:
+        print(f"[PLAN] Объектов {cls}: {total_instances[cls]}")
+    print(f"[PLAN] Объем изображений: {total_bytes / 1024 ** 2:.1f} МБ")
+    hours, rest = divmod(int(estimate), 3600)
+    print(f"[PLAN] Оценка времени объединения: {hours}:{rest // 60:02d}:{rest % 60:02d}")
+
+
+def write_data_yaml(yaml_path, split_sources, selected_classes, shards=False):
+    with open(yaml_path, "w", encoding="utf-8") as f:
+        f.write(f"train: {split_sources['train']}\n")
+        f.write(f"val: {split_sources['valid']}\n")
+        f.write(f"test: {split_sources['test']}\n\n")
+        f.write(f"nc: {len(selected_classes)}\n")
+        f.write(f"names: {selected_classes}\n")
+        if shards:
+            # Признак для model_training_module.py: читать данные из шардов
+            f.write("shards: true\n")
+
+
+def merge_datasets(args):
+    stage_stats = StageStats()
+
     # Определяем пути
     source_dir = args.source_path if args.source_path else BASE_DIR
     target_dir = args.target_path if args.target_path else OUTPUT_DIR
@@ -152,9 +997,28 @@ def main():
     with open(class_names_file, "r", encoding="utf-8") as f:
         class_names_map = json.load(f)
 
-    for split in ["train", "valid", "test"]:
-        safe_mkdir(os.path.join(target_dir, split, "images"))
-        safe_mkdir(os.path.join(target_dir, split, "labels"))
+    if args.shards and (args.virtual or args.incremental):
+        print("[ERROR] --shards нельзя использовать вместе с --virtual или --incremental")
+        return
+
+    if args.resize_to and args.virtual:
+        print("[ERROR] --resize-to нельзя использовать вместе с --virtual")
+        return
+
+    resize = None
+    if args.resize_to:
+        resize = {
+            "max_side": args.resize_to,
+            "format": args.format,
+            "quality": args.quality if args.quality else RESIZE_QUALITY,
+        }
+        if args.materialize and args.materialize != "copy":
+            print(f"[WARNING] --materialize {args.materialize} игнорируется при --resize-to")
+
+    # В режиме --virtual изображения представлены символическими ссылками на исходные файлы:
+    # Ultralytics ищет аннотацию, заменяя /images/ на /labels/ в пути изображения из списка,
+    # поэтому ссылки и отфильтрованные аннотации лежат рядом в каталоге VIRTUAL_CACHE_DIR
+    output_root = os.path.join(target_dir, VIRTUAL_CACHE_DIR) if args.virtual else target_dir
 
     matching_datasets = []
     output_dataset_name = os.path.basename(target_dir)
@@ -176,69 +1040,158 @@ def main():
     for name, _ in matching_datasets:
         print(f"   - {name}")
 
-    total_labels = 0
-    for dataset_name, info in matching_datasets:
-        dataset_path = os.path.join(source_dir, dataset_name)
-        for _, labels_path in find_dataset_paths(dataset_path, info["structure"], args.exclude_test):
-            total_labels += len([f for f in os.listdir(labels_path) if f.endswith(".txt")])
-
-    image_counter = 0
-
-    with tqdm(total=total_labels, desc="Обработка датасетов", unit="файл") as pbar:
-        for dataset_name, info in matching_datasets:
-            dataset_path = os.path.join(source_dir, dataset_name)
-            for images_path, labels_path in find_dataset_paths(dataset_path, info["structure"], args.exclude_test):
-
-                pairs = []
-                for label_file in os.listdir(labels_path):
-                    if not label_file.endswith(".txt"):
-                        continue
-                    image_name = os.path.splitext(label_file)[0]
-                    for ext in [".jpg", ".jpeg", ".png"]:
-                        candidate = os.path.join(images_path, image_name + ext)
-                        if os.path.exists(candidate):
-                            pairs.append((candidate, os.path.join(labels_path, label_file)))
-                            break
-
-                if not pairs:
-                    continue
-
-                random.shuffle(pairs)
-                n = len(pairs)
-                train_split = pairs[:int(n * TRAIN_PART)]
-                val_split = pairs[int(n * TRAIN_PART):int(n * (TRAIN_PART + VAL_PART))]
-                test_split = pairs[int(n * (VAL_PART + TRAIN_PART)):]
-
-                splits_data = {"train": train_split, "valid": val_split, "test": test_split}
-
-                for split_name, split_pairs in splits_data.items():
-                    for image_src, label_src in split_pairs:
-                        image_ext = os.path.splitext(image_src)[1]
-                        image_dst = os.path.join(target_dir, split_name, "images", f"{dataset_name}_{image_counter}{image_ext}")
-                        label_dst = os.path.join(target_dir, split_name, "labels", f"{dataset_name}_{image_counter}.txt")
-
-                        ok = filter_label_file(label_src, label_dst, info["classes"], class_names_map, selected_classes)
-                        if ok:
-                            shutil.copy2(image_src, image_dst)
-                            image_counter += 1
-                        pbar.update(1)
+    workers = args.workers if args.workers else WORKERS
+    materialize = args.materialize if args.materialize else MATERIALIZE_MODE
+    if args.virtual:
+        if args.materialize and args.materialize != "symlink":
+            print(f"[WARNING] --materialize {args.materialize} игнорируется в режиме --virtual")
+        materialize = "symlink"
+    index_dir = os.path.join(info_dir, INDEX_DIR_NAME) if args.use_index else None
+    label_filters = build_label_filters(
+        matching_datasets, source_dir, class_names_map, selected_classes, index_dir, stage_stats
+    )
+
+    image_info = None
+    corrupt_pairs = Counter()
+    if args.use_image_index:
+        image_info = load_image_info(
+            matching_datasets, source_dir, os.path.join(info_dir, IMAGE_INDEX_DIR_NAME), workers, stage_stats,
+            probe=not args.plan
+        )
+
+    merge_manifest = None
+    manifest_path = os.path.join(target_dir, MERGE_MANIFEST_FILE)
+    if args.incremental:
+        layout = "virtual" if args.virtual else materialize
+        if resize:
+            layout += f"-resize{resize['max_side']}-{resize['format'] or 'keep'}-q{resize['quality']}"
+        merge_manifest = load_merge_manifest(manifest_path, selected_classes, layout)
+
+    split_mode = args.split_mode if args.split_mode else SPLIT_MODE
+    if args.plan:
+        plan = None if args.plan_exact else plan_from_stats(
+            matching_datasets, class_names_map, selected_classes, args.exclude_test
+        )
+        if plan is not None:
+            print("[PLAN] Оценка по статистике datasets_info.json (аннотации не читаются, split - исходных датасетов)")
+        else:
+            pairs = iter_split_pairs(matching_datasets, source_dir, args.exclude_test, split_mode=split_mode)
+            if image_info is not None:
+                pairs = skip_corrupt_pairs(pairs, image_info, corrupt_pairs)
+            if split_mode == "stratified":
+                pairs = stratified_split_pairs(pairs, label_filters, source_dir, workers)
+            plan = plan_merge(pairs, label_filters, selected_classes)
+        print_merge_plan(plan, selected_classes, workers, copies_images=materialize == "copy" or bool(resize))
+        return
+
+    if not args.shards:
+        for split in ["train", "valid", "test"]:
+            safe_mkdir(os.path.join(output_root, split, "images"))
+            safe_mkdir(os.path.join(output_root, split, "labels"))
+
+    dedup_index = None
+    dedup_pairs = Counter()
+    dedup_action = args.dedup_action if args.dedup_action else DEDUP_ACTION
+    if args.dedup_threshold is not None:
+        dedup_index = new_dedup_index(args.dedup_threshold)
+    dedup_kwargs = {"dedup_index": dedup_index, "dedup_action": dedup_action, "dedup_pairs": dedup_pairs}
+
+    pairing_stats = {}
+    pairs = iter_split_pairs(matching_datasets, source_dir, args.exclude_test, pairing_stats, split_mode, stage_stats)
+    if image_info is not None:
+        pairs = skip_corrupt_pairs(pairs, image_info, corrupt_pairs)
+    if split_mode == "stratified":
+        pairs = stratified_split_pairs(pairs, label_filters, source_dir, workers, merge_manifest)
+    image_kwargs = {"image_info": image_info, "output_sizes": {} if image_info is not None else None}
+    if args.virtual:
+        manifests = {
+            split: open(os.path.join(target_dir, f"{split}.txt"), "w", encoding="utf-8")
+            for split in ["train", "valid", "test"]
+        }
+        try:
+            total_labels, image_counter = merge_pairs(
+                pairs, label_filters, output_root, workers, materialize, manifests,
+                merge_manifest=merge_manifest, manifest_dir=target_dir,
+                stage_stats=stage_stats, **image_kwargs, **dedup_kwargs
+            )
+        finally:
+            for manifest in manifests.values():
+                manifest.close()
+        split_sources = {split: f"./{split}.txt" for split in manifests}
+    elif args.shards:
+        shard_writers = {
+            split: ShardWriter(os.path.join(target_dir, SHARDS_DIR, split))
+            for split in ["train", "valid", "test"]
+        }
+        try:
+            total_labels, image_counter = merge_pairs(
+                pairs, label_filters, target_dir, workers, materialize,
+                shard_writers=shard_writers, resize=resize,
+                stage_stats=stage_stats, **image_kwargs, **dedup_kwargs
+            )
+        finally:
+            for writer in shard_writers.values():
+                writer.close()
+        split_sources = {split: f"./{SHARDS_DIR}/{split}" for split in shard_writers}
+    else:
+        total_labels, image_counter = merge_pairs(
+            pairs, label_filters, target_dir, workers, materialize,
+            merge_manifest=merge_manifest, manifest_dir=target_dir,
+            resize=resize, stage_stats=stage_stats, **image_kwargs, **dedup_kwargs
+        )
+        split_sources = {split: f"./{split}/images" for split in ["train", "valid", "test"]}
+
+    if merge_manifest is not None:
+        save_merge_manifest(manifest_path, merge_manifest)
 
     print(f"\n[DEBUG] Всего label-файлов: {total_labels}")
     print(f"[DEBUG] Отфильтровано и скопировано: {image_counter}")
-    print(f"[DEBUG] Процент используемых файлов: {image_counter / total_labels * 100:.2f}%")
+    if total_labels:
+        print(f"[DEBUG] Процент используемых файлов: {image_counter / total_labels * 100:.2f}%")
+
+    if dedup_index is not None:
+        print(f"[INFO] Найдено дубликатов: {sum(dedup_pairs.values())} "
+              f"({'исключены' if dedup_action == 'drop' else 'помещены в split оригинала'})")
+        for (first, second), count in dedup_pairs.most_common():
+            print(f"   - {first} / {second}: {count}")
+        save_dedup_report(os.path.join(target_dir, DEDUP_REPORT_FILE), dedup_pairs, args.dedup_threshold, dedup_action)
+
+    if image_info is not None:
+        skipped = {key: count for key, count in corrupt_pairs.items() if key[1] in SKIP_STATUSES}
+        print(f"[INFO] Пропущено пар с поврежденными изображениями: {sum(skipped.values())}")
+        for (dataset_name, status), count in sorted(skipped.items()):
+            print(f"   - {dataset_name} ({status}): {count}")
+        for (dataset_name, status), count in sorted(corrupt_pairs.items()):
+            if status not in SKIP_STATUSES:
+                print(f"[WARNING] {dataset_name}: {count} JPEG без маркера конца (Ultralytics восстановит их при обучении)")
+        sizes_path = os.path.join(target_dir, IMAGE_SIZES_FILE)
+        with open(sizes_path, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(image_kwargs["output_sizes"].items())), f, ensure_ascii=False)
+        print(f"[OK] Размеры изображений сохранены в {sizes_path}")
+
+    for dataset_name, (unpaired_labels, unpaired_images) in pairing_stats.items():
+        if unpaired_labels or unpaired_images:
+            print(f"[WARNING] {dataset_name}: аннотаций без изображений - {unpaired_labels}, "
+                  f"изображений без аннотаций - {unpaired_images}")
 
     print(f"\n[OK] Скопировано {image_counter} изображений с фильтрованными аннотациями.")
 
     yaml_path = os.path.join(target_dir, "data.yaml")
-    with open(yaml_path, "w", encoding="utf-8") as f:
-        f.write("train: ./train/images\n")
-        f.write("val: ./valid/images\n")
-        f.write("test: ./test/images\n\n")
-        f.write(f"nc: {len(selected_classes)}\n")
-        f.write(f"names: {selected_classes}\n")
+    write_data_yaml(yaml_path, split_sources, selected_classes, shards=args.shards)
 
     print(f"[OK] Итоговый YAML создан: {yaml_path}")
 
+    stage_stats.print_summary()
+    stage_report_path = os.path.join(target_dir, STAGE_REPORT_FILE)
+    stage_stats.save(stage_report_path)
+    print(f"[OK] Отчет по этапам сохранен в {stage_report_path}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with profiled(args.profile):
+        merge_datasets(args)
+
 
 if __name__ == "__main__":
     main()
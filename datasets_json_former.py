@@ -1,8 +1,19 @@
 import os
 import yaml
 import json
+import hashlib
 import sys
+import math
+import time
 import argparse
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from annotation_index import INDEX_DIR_NAME, refresh_index
+from image_probe import IMAGE_INDEX_DIR_NAME, refresh_image_index
+from dataset_former import find_dataset_paths, IMAGE_EXTS
+from stage_stats import STAGE_REPORT_FILE, StageStats, measure, profiled
+from fs_watch import InotifyWatcher, PollingWatcher, wait_settled
 
 
 sys.stdout.reconfigure(encoding='utf-8')
@@ -10,30 +21,15 @@ sys.stdout.reconfigure(encoding='utf-8')
 BASE_DIR = "/media/user/Data/IndustrialSafety/Datasets"
 OUTPUT_FILE = "datasets_info.json"
 OUTPUT_CLASS_NAMES_FILE = "class_names.json"
-
-
-def find_yaml_file(folder_path):
-    for root, _, files in os.walk(folder_path):
-        for f in files:
-            if f.lower() in ("data.yaml", "data.yml"):
-                return os.path.join(root, f)
-    return None
-
-
-def find_obj_names_file(folder_path):
-    for root, _, files in os.walk(folder_path):
-        for f in files:
-            if f.lower() == "obj.names":
-                return os.path.join(root, f)
-    return None
-
-
-def find_obj_data_file(folder_path):
-    for root, _, files in os.walk(folder_path):
-        for f in files:
-            if f.lower() == "obj.data":
-                return os.path.join(root, f)
-    return None
+OUTPUT_CACHE_FILE = "datasets_cache.json"
+CACHE_VERSION = 2
+WORKERS = 1
+DEBOUNCE_SECONDS = 5  # Пауза без изменений перед пересканированием в режиме --watch
+POLL_INTERVAL = 10  # Интервал опроса в режиме --watch без inotify
+STATS_CHUNK_SIZE = 2000  # Аннотаций в одной задаче пула при подсчете статистики
+BOX_SIZE_BINS = [0.0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.4, 1.0]  # Границы sqrt(w * h) нормированной рамки
+CONFIG_FILES = {"data.yaml": "yaml", "data.yml": "yaml", "obj.names": "obj_names", "obj.data": "obj_data"}
+COUNTED_EXTS = ["jpg", "jpeg", "png", "bmp", "webp", "txt"]
 
 
 def load_obj_names(file_path):
@@ -65,22 +61,78 @@ def load_obj_data(file_path):
         return None
 
 
-def detect_structure(folder_path):
-    subfolders = [d.lower() for d in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, d))]
+def scan_dataset_tree(folder_path):
+    """
+    Один обход дерева датасета через os.scandir.
+    Собирает первые (в порядке os.walk) файлы data.yaml/data.yml, obj.names, obj.data
+    и для каждого каталога - список подкаталогов и число файлов по расширениям.
+    Каталоги-ссылки обходятся только для подсчета файлов (os.walk в них не заходит).
+    Для кэша метаданных запоминаются mtime каталогов (до чтения) и mtime и размеры файлов конфигурации.
+    Возвращает {"yaml", "obj_names", "obj_data": путь или None, "dirs": {относительный путь: {...}},
+    "signature": {"dirs": {...}, "configs": {...}}}.
+    """
+    tree = {"yaml": None, "obj_names": None, "obj_data": None, "dirs": {}, "signature": {"dirs": {}, "configs": {}}}
+    visited_links = set()
+
+    def visit(dir_path, rel_dir, find_configs):
+        subdirs = []
+        files = []
+        try:
+            tree["signature"]["dirs"][rel_dir] = os.stat(dir_path).st_mtime_ns
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        subdirs.append(entry)
+                    else:
+                        files.append(entry.name)
+        except OSError:
+            return
+
+        # Подсчет по расширениям и поиск файлов конфигурации выполняются поиском
+        # подстрок в одной строке со всеми именами каталога, а не циклом по файлам
+        listing = "\n" + "\n".join(files).lower() + "\n"
+        ext_counts = Counter({ext: listing.count(f".{ext}\n") for ext in COUNTED_EXTS})
+        if find_configs and any(f"\n{name}\n" in listing for name in CONFIG_FILES):
+            for name in files:
+                config_key = CONFIG_FILES.get(name.lower())
+                if config_key and tree[config_key] is None:
+                    tree[config_key] = os.path.join(dir_path, name)
+                    st = os.stat(tree[config_key])
+                    tree["signature"]["configs"][os.path.join(rel_dir, name)] = [st.st_mtime_ns, st.st_size]
+
+        tree["dirs"][rel_dir] = {
+            "subdirs": [entry.name for entry in subdirs], "files": len(files), "exts": ext_counts
+        }
+
+        for entry in subdirs:
+            is_link = entry.is_symlink()
+            if is_link:
+                st = entry.stat()
+                if (st.st_dev, st.st_ino) in visited_links:
+                    continue
+                visited_links.add((st.st_dev, st.st_ino))
+            visit(entry.path, os.path.join(rel_dir, entry.name), find_configs and not is_link)
+
+    visit(folder_path, "", True)
+    return tree
+
+
+def detect_structure(folder_path, tree=None):
+    if tree is None:
+        tree = scan_dataset_tree(folder_path)
+
+    root_dirs = tree["dirs"].get("", {"subdirs": []})["subdirs"]
+    subfolders = [d.lower() for d in root_dirs]
 
     # Проверка на формат Darknet YOLO
-    obj_train_data_path = os.path.join(folder_path, "obj_train_data")
-    obj_names_path = find_obj_names_file(folder_path)
-    obj_data_path = find_obj_data_file(folder_path)
-    
-    if os.path.exists(obj_train_data_path) and (obj_names_path or obj_data_path):
+    if "obj_train_data" in root_dirs and (tree["obj_names"] or tree["obj_data"]):
         return "darknet"
 
     if any(x in subfolders for x in ["train", "val", "test"]):
         return "split"
 
-    elif all(os.path.exists(os.path.join(folder_path, subdir)) for subdir in ["images", "labels"]):
-        images_sub = os.listdir(os.path.join(folder_path, "images"))
+    elif all(subdir in root_dirs for subdir in ["images", "labels"]):
+        images_sub = tree["dirs"].get("images", {"subdirs": []})["subdirs"]
         if any(x in images_sub for x in ["train", "val", "test"]):
             return "nested_split"
         return "flat"
@@ -98,99 +150,63 @@ def load_yaml(file_path):
         return None
 
 
-def count_elements(folder_path, structure):
+def count_elements(folder_path, structure, tree=None):
     labels_count = 0
     images_count = 0
-    IMAGE_EXTS = [".jpg", ".jpeg", ".png"]
+    IMAGE_EXTS = ["jpg", "jpeg", "png"]
 
-    if structure == "split":
-        for dir_name in os.listdir(folder_path):
-            dir_path = os.path.join(folder_path, dir_name)
-            if not os.path.isdir(dir_path):
-                continue
-
-            img_dir = os.path.join(folder_path, dir_name, "images")
-            lbl_dir = os.path.join(folder_path, dir_name, "labels")
+    if tree is None:
+        tree = scan_dataset_tree(folder_path)
 
-            if os.path.exists(img_dir):
-                images_count += len([
-                    f for f in os.listdir(img_dir)
-                    if any(f.lower().endswith(ext) for ext in IMAGE_EXTS)
-                ])
+    def dir_counts(rel_dir):
+        ext_counts = tree["dirs"].get(rel_dir, {"exts": Counter()})["exts"]
+        return sum(ext_counts[ext] for ext in IMAGE_EXTS), ext_counts["txt"]
 
-            if os.path.exists(lbl_dir):
-                labels_count += len([
-                    f for f in os.listdir(lbl_dir)
-                    if f.lower().endswith(".txt")
-                ])
+    if structure == "split":
+        for dir_name in tree["dirs"].get("", {"subdirs": []})["subdirs"]:
+            images_count += dir_counts(os.path.join(dir_name, "images"))[0]
+            labels_count += dir_counts(os.path.join(dir_name, "labels"))[1]
 
     elif structure == "flat":
-        img_dir = os.path.join(folder_path, "images")
-        lbl_dir = os.path.join(folder_path, "labels")
-
-        images_count = len([
-            f for f in os.listdir(img_dir)
-            if any(f.lower().endswith(ext) for ext in IMAGE_EXTS)
-        ]) if os.path.exists(img_dir) else 0
-
-        labels_count = len([
-            f for f in os.listdir(lbl_dir)
-            if f.lower().endswith(".txt")
-        ]) if os.path.exists(lbl_dir) else 0
+        images_count = dir_counts("images")[0]
+        labels_count = dir_counts("labels")[1]
 
     elif structure == "nested_split":
         for split in ["train", "val", "test"]:
-            img_dir = os.path.join(folder_path, "images", split)
-            lbl_dir = os.path.join(folder_path, "labels", split)
-
-            if os.path.exists(img_dir):
-                images_count += len([
-                    f for f in os.listdir(img_dir)
-                    if any(f.lower().endswith(ext) for ext in IMAGE_EXTS)
-                ])
-
-            if os.path.exists(lbl_dir):
-                labels_count += len([
-                    f for f in os.listdir(lbl_dir)
-                    if f.lower().endswith(".txt")
-                ])
+            images_count += dir_counts(os.path.join("images", split))[0]
+            labels_count += dir_counts(os.path.join("labels", split))[1]
 
     elif structure == "darknet":
-        obj_train_data_path = os.path.join(folder_path, "obj_train_data")
-        if os.path.exists(obj_train_data_path):
-            files = os.listdir(obj_train_data_path)
-            images_count = len([
-                f for f in files
-                if any(f.lower().endswith(ext) for ext in IMAGE_EXTS)
-            ])
-            labels_count = len([
-                f for f in files
-                if f.lower().endswith(".txt")
-            ])
+        if "obj_train_data" in tree["dirs"]:
+            images_count, labels_count = dir_counts("obj_train_data")
         else:
             return None
 
     else:
         return None
 
-    if images_count == labels_count:
-        return images_count
-    else:
+    if images_count != labels_count:
         print(f"[WARNING] В папке {folder_path} число изображений ({images_count}) "
               f"не совпадает с числом аннотаций ({labels_count})")
-        return images_count, labels_count
+    return {"images": images_count, "labels": labels_count}
 
 
 
-def process_dataset(folder_path, folder_name):
-    yaml_path = find_yaml_file(folder_path)
-    
+def process_dataset(folder_path, folder_name, stage_stats=None, tree=None):
+    if tree is None:
+        with measure(stage_stats, "scan_tree", folder_name) as record:
+            tree = scan_dataset_tree(folder_path)
+            record["files"] = sum(d["files"] for d in tree["dirs"].values())
+    yaml_path = tree["yaml"]
+
     names = None
-    structure = detect_structure(folder_path)
+    structure = detect_structure(folder_path, tree)
 
     # Попытка загрузить из YAML (формат YOLOv8)
     if yaml_path:
-        data = load_yaml(yaml_path)
+        with measure(stage_stats, "read_meta", folder_name) as record:
+            data = load_yaml(yaml_path)
+            record["bytes"] = os.path.getsize(yaml_path)
         if data and "names" in data:
             names = data["names"]
             if isinstance(names, list):
@@ -203,7 +219,7 @@ def process_dataset(folder_path, folder_name):
 
     # Если не нашли YAML, пробуем формат Darknet
     if not names and structure == "darknet":
-        obj_names_path = find_obj_names_file(folder_path)
+        obj_names_path = tree["obj_names"]
         if obj_names_path:
             names = load_obj_names(obj_names_path)
             if not names:
@@ -218,7 +234,7 @@ def process_dataset(folder_path, folder_name):
         print(f"[WARNING] В папке {folder_name} не найден data.yaml или obj.names — пропуск")
         return None
 
-    elements_count = count_elements(folder_path, structure)
+    elements_count = count_elements(folder_path, structure, tree)
 
     return {
         "classes": {name: idx for idx, name in enumerate(names)},
@@ -246,53 +262,550 @@ def parse_args():
         help="Путь для сохранения выходных JSON файлов (если не указан, используется директория с датасетами)"
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Количество потоков для параллельного сканирования датасетов (если не указано, используется значение WORKERS)"
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Пересканировать все датасеты, не используя кэш datasets_cache.json"
+    )
+
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Прочитать аннотации и добавить в datasets_info.json статистику по split и классам "
+             "(изображения, объекты, размеры рамок, пустые аннотации); при --workers > 1 - в пуле процессов"
+    )
+
+    parser.add_argument(
+        "--probe-images",
+        action="store_true",
+        help="Проверить заголовки всех изображений (формат, размер, маркер конца JPEG) без декодирования "
+             "и сохранить индекс image_index для dataset_former.py --use-image-index"
+    )
+
+    parser.add_argument(
+        "--build-index",
+        action="store_true",
+        help="Построить (обновить) индекс аннотаций annotation_index для быстрой фильтрации в dataset_former.py"
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="После сканирования следить за папкой датасетов (inotify или опрос) и пересканировать "
+             "только измененные датасеты"
+    )
+
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="В режиме --watch использовать опрос вместо inotify (для сетевых файловых систем)"
+    )
+
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=None,
+        help="Интервал опроса в секундах (если не указан, используется значение POLL_INTERVAL)"
+    )
+
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=None,
+        help="Сколько секунд ждать окончания изменений перед пересканированием "
+             "(если не указано, используется значение DEBOUNCE_SECONDS)"
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Сохранить профиль выполнения cProfile в указанный файл (просмотр: python -m pstats <файл>)"
+    )
+
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
-    
+def load_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except Exception as e:
+        print(f"[WARNING] Не удалось прочитать кэш {cache_path}: {e}")
+        return {}
+    if cache.get("version") != CACHE_VERSION:
+        return {}
+    return cache.get("datasets", {})
+
+
+def write_json_atomic(path, data, indent=None):
+    """Запись JSON через временный файл: читатели видят либо старую, либо новую версию файла"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+
+def save_cache(cache_path, entries):
+    write_json_atomic(cache_path, {"version": CACHE_VERSION, "datasets": entries})
+
+
+def signature_matches(folder_path, signature):
+    """
+    Датасет не изменился, если совпадают mtime всех его каталогов (добавление, удаление
+    и переименование файлов меняют mtime каталога) и mtime и размеры файлов конфигурации.
+    """
+    try:
+        for rel_dir, mtime in signature["dirs"].items():
+            if os.stat(os.path.join(folder_path, rel_dir)).st_mtime_ns != mtime:
+                return False
+        for rel_path, (mtime, size) in signature["configs"].items():
+            st = os.stat(os.path.join(folder_path, rel_path))
+            if st.st_mtime_ns != mtime or st.st_size != size:
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def scan_folder(datasets_dir, folder_name, stage_stats=None, cached=None):
+    """
+    Обработка датасета в потоке пула: ошибка в одном датасете не прерывает остальные.
+    cached - запись кэша датасета: если датасет не изменился, он не обходится заново.
+    Возвращает (информация о датасете или None, запись кэша или None, взята ли из кэша).
+    """
+    folder_path = os.path.join(datasets_dir, folder_name)
+    abs_path = os.path.abspath(folder_path)
+    try:
+        if cached is not None and cached["path"] == abs_path:
+            with measure(stage_stats, "check_cache", folder_name):
+                unchanged = signature_matches(folder_path, cached["signature"])
+            if unchanged:
+                return cached["info"], cached, True
+
+        with measure(stage_stats, "scan_tree", folder_name) as record:
+            tree = scan_dataset_tree(folder_path)
+            record["files"] = sum(d["files"] for d in tree["dirs"].values())
+        info = process_dataset(folder_path, folder_name, stage_stats, tree)
+        entry = {"path": abs_path, "signature": tree["signature"], "info": info} if info else None
+        return info, entry, False
+    except Exception as e:
+        print(f"[ERROR] Не удалось обработать датасет {folder_name}: {e}")
+        return None, None, False
+
+
+def load_class_names(class_names_file):
+    """Существующее соответствие имен классов (ручные нормализации сохраняются при повторном запуске)"""
+    if not os.path.exists(class_names_file):
+        return {}
+    try:
+        with open(class_names_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARNING] Не удалось прочитать {class_names_file}: {e}")
+        return {}
+
+
+def split_label_dirs(folder_path, structure):
+    """Каталоги (изображения, аннотации) датасета с именами split (для flat и darknet - "all")"""
+    result = []
+    for images_path, labels_path in find_dataset_paths(folder_path, structure):
+        if structure == "split":
+            split_name = os.path.basename(os.path.dirname(labels_path))
+        elif structure == "nested_split":
+            split_name = os.path.basename(labels_path)
+        else:
+            split_name = "all"
+        result.append((split_name, images_path, labels_path))
+    return result
+
+
+def scan_stats_files(images_path, labels_path, signature):
+    """
+    Аннотации split и размеры парных изображений (как при сопоставлении в dataset_former.py:
+    по имени без расширения, с приоритетом IMAGE_EXTS). mtime и размеры файлов добавляются в signature.
+    Возвращает список (путь к аннотации, размер изображения или None).
+    """
+    image_sizes = {}
+    with os.scandir(images_path) as it:
+        images = sorted(
+            (entry for entry in it if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS and entry.is_file()),
+            key=lambda entry: (os.path.splitext(entry.name)[0], IMAGE_EXTS.index(os.path.splitext(entry.name)[1].lower()))
+        )
+    for entry in images:
+        st = entry.stat()
+        signature.update(f"{entry.path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode("utf-8"))
+        image_sizes.setdefault(os.path.splitext(entry.name)[0], st.st_size)
+
+    labels = []
+    with os.scandir(labels_path) as it:
+        label_entries = sorted((entry for entry in it if entry.name.endswith(".txt")), key=lambda entry: entry.name)
+    for entry in label_entries:
+        st = entry.stat()
+        signature.update(f"{entry.path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode("utf-8"))
+        labels.append((entry.path, image_sizes.get(entry.name[:-4])))
+    return labels
+
+
+def box_size_bin(w, h):
+    size = math.sqrt(max(w, 0.0) * max(h, 0.0))
+    return min(max(bisect_right(BOX_SIZE_BINS, size) - 1, 0), len(BOX_SIZE_BINS) - 2)
+
+
+def label_file_stats(labels):
+    """
+    Статистика по списку (путь к аннотации, размер изображения или None) (выполняется в процессе пула).
+    Объектом считается каждая строка с целым id класса, как при фильтрации в dataset_former.py;
+    размер берется из рамки (5 полей) или из охватывающего прямоугольника полигона.
+    Возвращает {"labels", "empty", "bytes", "image_bytes", "seconds",
+    "classes": {id: [изображения, объекты, гистограмма]},
+    "class_sets": {кортеж id классов: [изображения, объем изображений]}}.
+    """
+    start = time.perf_counter()
+    result = {"labels": 0, "empty": 0, "bytes": 0, "image_bytes": 0, "classes": {}, "class_sets": {}}
+    n_bins = len(BOX_SIZE_BINS) - 1
+
+    for label_path, image_bytes in labels:
+        try:
+            with open(label_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        result["labels"] += 1
+        result["bytes"] += len(content)
+        result["image_bytes"] += image_bytes or 0
+
+        present = set()
+        for line in content.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            try:
+                class_id = int(parts[0])
+            except ValueError:
+                continue
+            record = result["classes"].get(class_id)
+            if record is None:
+                record = result["classes"][class_id] = [0, 0, [0] * n_bins]
+            record[1] += 1
+            present.add(class_id)
+
+            try:
+                coords = [float(v) for v in parts[1:]]
+            except ValueError:
+                continue
+            if len(coords) == 4:
+                record[2][box_size_bin(coords[2], coords[3])] += 1
+            elif len(coords) >= 6 and len(coords) % 2 == 0:
+                xs, ys = coords[0::2], coords[1::2]
+                record[2][box_size_bin(max(xs) - min(xs), max(ys) - min(ys))] += 1
+
+        if not present:
+            result["empty"] += 1
+        for class_id in present:
+            result["classes"][class_id][0] += 1
+        class_set = result["class_sets"].setdefault(tuple(sorted(present)), [0, 0])
+        class_set[0] += 1
+        class_set[1] += image_bytes or 0
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def merge_label_stats(total, part):
+    for field in ("labels", "empty", "bytes", "image_bytes", "seconds"):
+        total[field] += part[field]
+    for class_id, (images, instances, hist) in part["classes"].items():
+        record = total["classes"].setdefault(class_id, [0, 0, [0] * len(hist)])
+        record[0] += images
+        record[1] += instances
+        record[2] = [a + b for a, b in zip(record[2], hist)]
+    for class_set, (images, image_bytes) in part["class_sets"].items():
+        record = total["class_sets"].setdefault(class_set, [0, 0])
+        record[0] += images
+        record[1] += image_bytes
+
+
+def format_label_stats(split_stats, class_map, signature):
+    """Статистика в формате datasets_info.json (id классов заменяются именами)"""
+    id_to_name = {idx: name for name, idx in class_map.items()}
+
+    def class_name(class_id):
+        return id_to_name.get(class_id, str(class_id))
+
+    splits = {}
+    for split_name, stats in split_stats.items():
+        splits[split_name] = {
+            "labels": stats["labels"],
+            "empty": stats["empty"],
+            "image_bytes": stats["image_bytes"],
+            "classes": {
+                class_name(class_id): {"images": images, "instances": instances, "box_sizes": hist}
+                for class_id, (images, instances, hist) in sorted(stats["classes"].items())
+            },
+            "class_sets": [
+                {"classes": [class_name(class_id) for class_id in class_set], "images": images, "bytes": image_bytes}
+                for class_set, (images, image_bytes) in sorted(
+                    stats["class_sets"].items(), key=lambda kv: (-kv[1][0], kv[0])
+                )
+            ],
+        }
+    return {"signature": signature, "box_size_bins": BOX_SIZE_BINS, "splits": splits}
+
+
+def build_label_stats(datasets_dir, datasets_info, workers, stage_stats=None, changed=None):
+    """
+    Статистика аннотаций для датасетов, у которых ее нет или она устарела: подпись статистики -
+    хэш путей, mtime и размеров всех аннотаций и изображений, поэтому правка аннотаций на месте
+    (не меняющая mtime каталога) тоже приводит к пересчету. Аннотации делятся на задачи
+    по STATS_CHUNK_SIZE файлов; при workers > 1 задачи выполняются в пуле процессов (разбор текста ограничен GIL).
+    changed - имена измененных датасетов (--watch): у остальных датасетов с сохраненной статистикой
+    подпись не проверяется; None - проверяются все датасеты.
+    """
+    tasks = []
+    signatures = {}
+    for folder_name, info in datasets_info.items():
+        if changed is not None and folder_name not in changed and "stats" in info:
+            continue
+        folder_path = os.path.join(datasets_dir, folder_name)
+        signature = hashlib.sha1()
+        dataset_tasks = []
+        for split_name, images_path, labels_path in split_label_dirs(folder_path, info["structure"]):
+            labels = scan_stats_files(images_path, labels_path, signature)
+            for i in range(0, max(len(labels), 1), STATS_CHUNK_SIZE):
+                dataset_tasks.append((folder_name, split_name, labels[i:i + STATS_CHUNK_SIZE]))
+
+        signatures[folder_name] = signature.hexdigest()
+        if info.get("stats", {}).get("signature") != signatures[folder_name]:
+            tasks.extend(dataset_tasks)
+
+    if not tasks:
+        return
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(label_file_stats, [task[2] for task in tasks]))
+    else:
+        results = [label_file_stats(task[2]) for task in tasks]
+
+    collected = {}
+    for (folder_name, split_name, _), part in zip(tasks, results):
+        total = collected.setdefault(folder_name, {}).setdefault(split_name, {
+            "labels": 0, "empty": 0, "bytes": 0, "image_bytes": 0, "seconds": 0.0, "classes": {}, "class_sets": {}
+        })
+        merge_label_stats(total, part)
+
+    for folder_name, split_stats in collected.items():
+        if stage_stats is not None:
+            stage_stats.add(
+                "label_stats", folder_name,
+                seconds=sum(stats["seconds"] for stats in split_stats.values()),
+                nbytes=sum(stats["bytes"] for stats in split_stats.values()),
+                files=sum(stats["labels"] for stats in split_stats.values()),
+            )
+        datasets_info[folder_name]["stats"] = format_label_stats(
+            split_stats, datasets_info[folder_name]["classes"], signatures[folder_name]
+        )
+        print(f"[INFO] Статистика {folder_name}: " + ", ".join(
+            f"{split_name} - {stats['labels']} аннотаций ({stats['empty']} пустых)"
+            for split_name, stats in split_stats.items()
+        ))
+
+
+def build_image_index(datasets_dir, datasets_info, index_dir, workers, stage_stats=None):
+    """Обновление индекса изображений всех датасетов (проверяются только новые и измененные файлы)"""
+    for folder_name, info in datasets_info.items():
+        folder_path = os.path.join(datasets_dir, folder_name)
+        image_dirs = [images_path for images_path, _ in find_dataset_paths(folder_path, info["structure"])]
+        if not image_dirs:
+            continue
+
+        with measure(stage_stats, "probe_images", folder_name) as record:
+            index = refresh_image_index(index_dir, folder_name, folder_path, image_dirs, IMAGE_EXTS, workers)
+            record["files"] = len(index["files"])
+
+
+def build_annotation_index(datasets_dir, datasets_info, index_dir, stage_stats=None):
+    """Обновление индекса аннотаций всех датасетов (перечитываются только измененные файлы)"""
+    for folder_name, info in datasets_info.items():
+        folder_path = os.path.join(datasets_dir, folder_name)
+        label_dirs = [labels_path for _, labels_path in find_dataset_paths(folder_path, info["structure"])]
+        if not label_dirs:
+            continue
+
+        with measure(stage_stats, "refresh_index", folder_name):
+            refresh_index(index_dir, folder_name, folder_path, label_dirs)
+
+
+def output_paths(args):
+    """Пути к datasets_info.json и class_names.json"""
+    datasets_dir = args.datasets_path if args.datasets_path else BASE_DIR
+    output_dir = args.output_path if args.output_path else datasets_dir
+    return os.path.join(output_dir, OUTPUT_FILE), os.path.join(output_dir, OUTPUT_CLASS_NAMES_FILE)
+
+
+def scan_datasets(args, rescan=()):
+    """
+    Сканирование всех датасетов; датасеты из rescan сканируются заново без проверки кэша,
+    и только для них (и датасетов без статистики) проверяется статистика аннотаций.
+    """
+    stage_stats = StageStats()
     datasets_dir = args.datasets_path if args.datasets_path else BASE_DIR
     
+    output_file, output_class_names_file = output_paths(args)
     if args.output_path:
-        output_dir = args.output_path
-        os.makedirs(output_dir, exist_ok=True)
-        output_file = os.path.join(output_dir, OUTPUT_FILE)
-        output_class_names_file = os.path.join(output_dir, OUTPUT_CLASS_NAMES_FILE)
-    else:
-        output_file = os.path.join(datasets_dir, OUTPUT_FILE)
-        output_class_names_file = os.path.join(datasets_dir, OUTPUT_CLASS_NAMES_FILE)
+        os.makedirs(args.output_path, exist_ok=True)
 
     datasets_info = {}
-    class_names = {}
+    class_names = load_class_names(output_class_names_file)
+    cache_path = os.path.join(os.path.dirname(output_file), OUTPUT_CACHE_FILE)
+    cache = {} if args.force else load_cache(cache_path)
+    new_cache = {}
+    reused = 0
 
     if not os.path.exists(datasets_dir):
         print(f"[ERROR] Папка '{datasets_dir}' не найдена.")
         return
 
-    for folder_name in os.listdir(datasets_dir):
-        folder_path = os.path.join(datasets_dir, folder_name)
-        if os.path.isdir(folder_path):
-            info = process_dataset(folder_path, folder_name)
+    # Датасеты сканируются параллельно, результаты собираются в порядке имен,
+    # поэтому JSON файлы не зависят от числа потоков и порядка os.listdir
+    folder_names = sorted(
+        folder_name for folder_name in os.listdir(datasets_dir)
+        if folder_name not in (INDEX_DIR_NAME, IMAGE_INDEX_DIR_NAME)
+        and os.path.isdir(os.path.join(datasets_dir, folder_name))
+    )
+    workers = args.workers if args.workers else WORKERS
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = executor.map(
+            lambda folder_name: scan_folder(
+                datasets_dir, folder_name, stage_stats, None if folder_name in rescan else cache.get(folder_name)
+            ),
+            folder_names
+        )
+        for folder_name, (info, cache_entry, from_cache) in zip(folder_names, results):
+            reused += from_cache
+            if cache_entry:
+                new_cache[folder_name] = cache_entry
             if info:
                 datasets_info[folder_name] = info
                 for class_name in info["classes"]:
-                    class_names[class_name] = class_name
+                    class_names.setdefault(class_name, class_name)
+
+    print(f"[INFO] Датасетов без изменений (из кэша): {reused}, просканировано: {len(folder_names) - reused}")
+
+    if args.stats:
+        build_label_stats(datasets_dir, datasets_info, max(1, workers), stage_stats, set(rescan) if rescan else None)
 
     try:
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(datasets_info, f, ensure_ascii=False, indent=4)
+        save_cache(cache_path, new_cache)
+    except Exception as e:
+        print(f"[WARNING] Не удалось записать кэш {cache_path}: {e}")
+
+    if args.probe_images:
+        build_image_index(
+            datasets_dir, datasets_info, os.path.join(os.path.dirname(output_file), IMAGE_INDEX_DIR_NAME),
+            max(1, workers), stage_stats
+        )
+
+    if args.build_index:
+        build_annotation_index(
+            datasets_dir, datasets_info, os.path.join(os.path.dirname(output_file), INDEX_DIR_NAME), stage_stats
+        )
+
+    try:
+        write_json_atomic(output_file, datasets_info, indent=4)
         print(f"[OK] Информация успешно сохранена в {output_file}")
     except Exception as e:
         print(f"[ERROR] Не удалось записать JSON: {e}")
 
     try:
-        with open(output_class_names_file, "w", encoding="utf-8") as f:
-            json.dump(class_names, f, ensure_ascii=False, indent=4)
+        write_json_atomic(output_class_names_file, class_names, indent=4)
         print(f"[OK] Информация успешно сохранена в {output_class_names_file}")
     except Exception as e:
         print(f"[ERROR] Не удалось записать JSON: {e}")
 
+    stage_stats.print_summary()
+    stage_report_path = os.path.join(os.path.dirname(output_file), STAGE_REPORT_FILE)
+    stage_stats.save(stage_report_path)
+    print(f"[OK] Отчет по этапам сохранен в {stage_report_path}")
+
+
+def watch_datasets(args):
+    """
+    Режим --watch: после полного сканирования ожидание изменений в папках датасетов.
+    После окончания серии изменений (пауза --debounce) заново сканируются только измененные датасеты,
+    остальные берутся из кэша; JSON файлы заменяются атомарно.
+    """
+    datasets_dir = args.datasets_path if args.datasets_path else BASE_DIR
+    output_file, _ = output_paths(args)
+    cache_path = os.path.join(os.path.dirname(output_file), OUTPUT_CACHE_FILE)
+    ignore = (INDEX_DIR_NAME, IMAGE_INDEX_DIR_NAME)
+    debounce = args.debounce if args.debounce is not None else DEBOUNCE_SECONDS
+    poll_interval = args.poll_interval if args.poll_interval else POLL_INTERVAL
+
+    signatures = {}
+
+    def load_signatures():
+        signatures.clear()
+        signatures.update({name: entry["signature"] for name, entry in load_cache(cache_path).items()})
+
+    def folder_state(folder_name):
+        # Для опроса: mtime каталогов и файлов конфигурации из кэша (или только корня датасета)
+        folder_path = os.path.join(datasets_dir, folder_name)
+        signature = signatures.get(folder_name, {"dirs": {"": None}, "configs": {}})
+        state = []
+        for rel_path in list(signature["dirs"]) + list(signature["configs"]):
+            try:
+                st = os.stat(os.path.join(folder_path, rel_path))
+                state.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                state.append(None)
+        return tuple(state)
+
+    scan_datasets(args)
+    load_signatures()
+
+    watcher = None
+    if not args.poll:
+        try:
+            watcher = InotifyWatcher(datasets_dir, ignore)
+            print(f"[INFO] Отслеживание изменений через inotify: {datasets_dir}")
+        except (OSError, AttributeError) as e:
+            print(f"[WARNING] inotify недоступен ({e}), используется опрос")
+    if watcher is None:
+        watcher = PollingWatcher(datasets_dir, folder_state, poll_interval, ignore)
+        print(f"[INFO] Отслеживание изменений опросом каждые {poll_interval} с: {datasets_dir}")
+
+    try:
+        while True:
+            changed = wait_settled(watcher, debounce)
+            print(f"\n[INFO] Изменены датасеты: {', '.join(sorted(changed))}")
+            scan_datasets(args, rescan=changed)
+            load_signatures()
+            watcher.reset()
+    except KeyboardInterrupt:
+        print("\n[INFO] Отслеживание остановлено")
+    finally:
+        watcher.close()
+
+
+def main():
+    args = parse_args()
+    with profiled(args.profile):
+        if args.watch:
+            watch_datasets(args)
+        else:
+            scan_datasets(args)
+
 
 if __name__ == "__main__":
     main()
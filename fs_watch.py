@@ -0,0 +1,175 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    Отслеживание изменений в папках верхнего уровня каталога root через inotify (Linux, через ctypes).
+    Наблюдение ставится на все подкаталоги; новые подкаталоги добавляются по мере появления.
+    wait_changes() возвращает множество имен папок верхнего уровня, в которых были изменения.
+    """
+
+    def __init__(self, root, ignore=()):
+        self.root = os.path.abspath(root)
+        self.ignore = set(ignore)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.paths = {}
+        self.watch_tree(self.root)
+
+    def watch_dir(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "Превышен лимит fs.inotify.max_user_watches")
+            return
+        self.paths[wd] = path
+
+    def watch_tree(self, path):
+        self.watch_dir(path)
+        for dir_path, dir_names, _ in os.walk(path):
+            if dir_path == self.root:
+                dir_names[:] = [name for name in dir_names if name not in self.ignore]
+            for name in dir_names:
+                self.watch_dir(os.path.join(dir_path, name))
+
+    def top_level_name(self, path):
+        rel_path = os.path.relpath(path, self.root)
+        return rel_path.split(os.sep)[0] if rel_path != "." else None
+
+    def wait_changes(self, timeout=None):
+        """Ожидание событий (timeout в секундах, None - без ограничения). Пустое множество - событий не было"""
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changed
+
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + name_len].rstrip(b"\0"))
+                offset += EVENT_HEADER.size + name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    # Очередь событий переполнена - считаются измененными все папки
+                    changed.update(
+                        entry.name for entry in os.scandir(self.root)
+                        if entry.is_dir() and entry.name not in self.ignore
+                    )
+                    continue
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                    continue
+
+                dir_path = self.paths.get(wd)
+                if dir_path is None:
+                    continue
+                path = os.path.join(dir_path, name) if name else dir_path
+                top_name = self.top_level_name(path)
+                if top_name is None or top_name in self.ignore:
+                    continue
+                if dir_path == self.root and not mask & IN_ISDIR:
+                    # Файлы в корне (в том числе datasets_info.json) датасетами не являются
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                    self.watch_tree(path)
+                changed.add(top_name)
+        return changed
+
+    def reset(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Отслеживание изменений опросом: для каждой папки верхнего уровня вызывается state_fn(имя),
+    возвращающая сравнимое состояние (например, mtime известных каталогов датасета).
+    Используется, если inotify недоступен, и для сетевых файловых систем, где inotify не видит изменений.
+    """
+
+    def __init__(self, root, state_fn, interval, ignore=()):
+        self.root = root
+        self.state_fn = state_fn
+        self.interval = interval
+        self.ignore = set(ignore)
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        snapshot = {}
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name not in self.ignore:
+                snapshot[entry.name] = self.state_fn(entry.name)
+        return snapshot
+
+    def wait_changes(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+            snapshot = self.take_snapshot()
+            changed = {
+                name for name in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(name) != self.snapshot.get(name)
+            }
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def reset(self):
+        """Новый снимок состояния (после пересканирования state_fn может описывать датасеты иначе)"""
+        self.snapshot = self.take_snapshot()
+
+    def close(self):
+        pass
+
+
+def wait_settled(watcher, debounce):
+    """
+    Ожидание изменений с подавлением дребезга: после первого события изменения
+    накапливаются, пока в течение debounce секунд не будет новых событий
+    (копирование большого датасета дает одно пересканирование).
+    """
+    changed = set()
+    while not changed:
+        changed = watcher.wait_changes()
+    while True:
+        more = watcher.wait_changes(debounce)
+        if not more:
+            return changed
+        changed |= more
@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import math
+import time
+import fcntl
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from ultralytics.utils.patches import imread
+from shard_io import SHARD_INDEX_FILE
+
+
+IMAGE_CACHE_DIR = "/media/user/Data/IndustrialSafety/ImageCache"
+IMAGE_CACHE_MAX_GB = 50
+IMAGE_CACHE_WORKERS = 8
+IMAGE_CACHE_VERSION = 1
+PIXELS_FILE = "pixels.bin"
+INDEX_FILE = "index.npz"
+META_FILE = "meta.json"
+PIN_SUFFIX = ".pin"
+
+
+def resize_long_side(im, imgsz):
+    """Уменьшение длинной стороны до imgsz с сохранением пропорций, как в BaseDataset.load_image (rect_mode)"""
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz))
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    if im.ndim == 2:
+        im = im[..., None]
+    return im
+
+
+def pin_entry(cache_dir, name):
+    """
+    Закрепление записи: разделяемая блокировка файла <name>.pin, пока открыт возвращенный файл.
+    prune_cache и image_cache.py --remove не удаляют закрепленные записи.
+    """
+    pin = open(os.path.join(cache_dir, name + PIN_SUFFIX), "w")
+    fcntl.flock(pin, fcntl.LOCK_SH)
+    return pin
+
+
+def remove_entry(cache_dir, name):
+    """Удаление записи, если она не закреплена другими процессами. Возвращает True, если запись удалена"""
+    with open(os.path.join(cache_dir, name + PIN_SUFFIX), "w") as pin:
+        try:
+            fcntl.flock(pin, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    return True
+
+
+class ImageCache:
+    """
+    Чтение изображений записи кэша: пиксели всех изображений лежат подряд в pixels.bin
+    и отображаются в память при первом обращении (в каждом процессе загрузчика - свое отображение).
+    pin - файл закрепления записи (pin_entry), закрывается вместе с объектом.
+    """
+
+    def __init__(self, entry_dir, pin=None):
+        self.entry_dir = entry_dir
+        self._pin = pin
+        with np.load(os.path.join(entry_dir, INDEX_FILE)) as index:
+            self.offsets = index["offsets"]
+            self.shapes = index["shapes"]
+            self.orig_shapes = index["orig_shapes"]
+        self._pixels = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def load(self, i):
+        """Изображение i как в load_image: (копия массива, (h0, w0), (h, w))"""
+        if self._pixels is None:
+            self._pixels = np.memmap(os.path.join(self.entry_dir, PIXELS_FILE), dtype=np.uint8, mode="r")
+        h, w, c = (int(v) for v in self.shapes[i])
+        offset = int(self.offsets[i])
+        im = np.array(self._pixels[offset:offset + h * w * c]).reshape(h, w, c)
+        return im, (int(self.orig_shapes[i][0]), int(self.orig_shapes[i][1])), (h, w)
+
+    def __getstate__(self):
+        # Отображение не передается в процессы загрузчика данных, каждый открывает свое
+        state = self.__dict__.copy()
+        state["_pixels"] = None
+        state["_pin"] = None
+        return state
+
+
+def dataset_fingerprint(im_files, imgsz, channels, shards_dir=None):
+    """
+    Ключ записи кэша: хэш списка изображений с размерами и mtime файлов, imgsz и числа каналов.
+    Для датасета в шардах вместо файлов учитывается index.json шардов.
+    """
+    digest = hashlib.sha1(f"{IMAGE_CACHE_VERSION}:{imgsz}:{channels}".encode())
+    if shards_dir is not None:
+        st = os.stat(os.path.join(shards_dir, SHARD_INDEX_FILE))
+        digest.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    for path in im_files:
+        digest.update(path.encode("utf-8", "surrogateescape"))
+        if shards_dir is None:
+            st = os.stat(path)
+            digest.update(f":{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def entry_name(fingerprint, imgsz):
+    return f"{fingerprint}_{imgsz}"
+
+
+def list_entries(cache_dir):
+    """Записи кэша: список словарей meta.json с именем, размером и временем последнего использования"""
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for name in sorted(os.listdir(cache_dir)):
+        if name.endswith(".tmp"):
+            continue
+        meta_path = os.path.join(cache_dir, name, META_FILE)
+        if not os.path.isfile(meta_path):
+            continue
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta["name"] = name
+        meta["last_used"] = os.path.getmtime(meta_path)
+        entries.append(meta)
+    return entries
+
+
+def prune_cache(cache_dir, max_bytes, keep=()):
+    """
+    Удаление давно не использованных записей, пока общий размер больше max_bytes.
+    Записи из keep и записи, закрепленные другими процессами (открытые обучениями), не удаляются.
+    Возвращает список удаленных записей.
+    """
+    entries = sorted(list_entries(cache_dir), key=lambda meta: meta["last_used"])
+    total = sum(meta["bytes"] for meta in entries)
+    removed = []
+    for meta in entries:
+        if total <= max_bytes:
+            break
+        if meta["name"] in keep or not remove_entry(cache_dir, meta["name"]):
+            continue
+        total -= meta["bytes"]
+        removed.append(meta)
+    return removed
+
+
+def build_entry(dataset, tmp_dir, imgsz, workers):
+    """
+    Декодирование и уменьшение всех изображений датасета в tmp_dir (pixels.bin и index.npz).
+    Изображения читаются dataset.read_image(i), если он есть (шарды), иначе imread Ultralytics.
+    """
+    n = len(dataset.im_files)
+    offsets = np.zeros(n, dtype=np.int64)
+    shapes = np.zeros((n, 3), dtype=np.int32)
+    orig_shapes = np.zeros((n, 2), dtype=np.int32)
+
+    read_image = getattr(dataset, "read_image", None)
+
+    def decode(i):
+        im = read_image(i) if read_image is not None else imread(dataset.im_files[i], flags=dataset.cv2_flag)
+        if im is None:
+            raise FileNotFoundError(f"Не удалось прочитать изображение {dataset.im_files[i]}")
+        h0, w0 = im.shape[:2]
+        return resize_long_side(im, imgsz), (h0, w0)
+
+    offset = 0
+    with open(os.path.join(tmp_dir, PIXELS_FILE), "wb") as f, ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for i, (im, orig_shape) in enumerate(executor.map(decode, range(n))):
+            data = np.ascontiguousarray(im)
+            f.write(data.data)
+            offsets[i] = offset
+            shapes[i] = data.shape
+            orig_shapes[i] = orig_shape
+            offset += data.nbytes
+
+    np.savez(os.path.join(tmp_dir, INDEX_FILE), offsets=offsets, shapes=shapes, orig_shapes=orig_shapes)
+    return offset
+
+
+def estimate_bytes(dataset, imgsz):
+    """
+    Оценка размера записи по размерам изображений из аннотаций датасета (без декодирования).
+    В датасетах с прямоугольными batch (rect) размеры удалены из аннотаций - берется верхняя граница imgsz x imgsz.
+    """
+    total = 0
+    for label in dataset.labels:
+        if "shape" not in label:
+            total += imgsz * imgsz * dataset.channels
+            continue
+        h0, w0 = label["shape"]
+        r = imgsz / max(h0, w0)
+        total += min(math.ceil(w0 * r), imgsz) * min(math.ceil(h0 * r), imgsz) * dataset.channels
+    return total
+
+
+def open_image_cache(dataset, cache_dir=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_GB * 1024 ** 3,
+                     workers=IMAGE_CACHE_WORKERS):
+    """
+    Общий кэш уменьшенных до imgsz изображений датасета Ultralytics.
+    Запись ищется по ключу dataset_fingerprint; если ее нет, давно не использованные записи
+    удаляются так, чтобы с новой записью кэш не превышал max_bytes, и запись создается
+    (под блокировкой: параллельные обучения на том же датасете ждут и используют готовую запись).
+    Запись закрепляется (pin_entry) до проверки ее наличия и остается закрепленной,
+    пока существует возвращенный ImageCache, поэтому очистка кэша другими процессами ее не удалит.
+    Возвращает ImageCache или None, если запись не помещается в кэш.
+    """
+    shards = getattr(dataset, "shards", None)
+    fingerprint = dataset_fingerprint(
+        dataset.im_files, dataset.imgsz, dataset.channels, shards.split_dir if shards is not None else None
+    )
+    name = entry_name(fingerprint, dataset.imgsz)
+    entry_dir = os.path.join(cache_dir, name)
+    meta_path = os.path.join(entry_dir, META_FILE)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with open(os.path.join(cache_dir, name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        pin = pin_entry(cache_dir, name)
+        if os.path.isfile(meta_path):
+            os.utime(meta_path)
+            print(f"[INFO] Кэш изображений {name}: {len(dataset.im_files)} изображений, запись найдена")
+            return ImageCache(entry_dir, pin)
+
+        estimate = estimate_bytes(dataset, dataset.imgsz)
+        if estimate > max_bytes:
+            print(f"[WARNING] Кэш изображений не используется: {estimate / 1024 ** 3:.1f} ГБ "
+                  f"больше ограничения {max_bytes / 1024 ** 3:.1f} ГБ")
+            pin.close()
+            return None
+        prune_cache(cache_dir, max_bytes - estimate, keep={name})
+
+        tmp_dir = entry_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        start = time.perf_counter()
+        try:
+            nbytes = build_entry(dataset, tmp_dir, dataset.imgsz, workers)
+            meta = {
+                "dataset": str(dataset.img_path),
+                "imgsz": dataset.imgsz,
+                "channels": dataset.channels,
+                "images": len(dataset.im_files),
+                "bytes": nbytes,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_dir, entry_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            pin.close()
+            raise
+
+    print(f"[OK] Кэш изображений {name}: {meta['images']} изображений, {nbytes / 1024 ** 3:.2f} ГБ "
+          f"за {time.perf_counter() - start:.1f} с")
+    return ImageCache(entry_dir, pin)
+
+
+class ImageCacheMixin:
+    """
+    Примесь к YOLODataset: load_image читает уменьшенные изображения из общего кэша image_cache
+    (задается после создания датасета). Без кэша и для режимов, отличных от уменьшения
+    длинной стороны до imgsz, используется обычная загрузка.
+    """
+
+    image_cache = None
+
+    def load_image(self, i, rect_mode=True, resize_short=False):
+        if self.image_cache is None or not rect_mode or resize_short or self.ims[i] is not None:
+            return super().load_image(i, rect_mode, resize_short)
+
+        im, hw0, hw = self.image_cache.load(i)
+        # Буфер последних изображений для мозаики, как в BaseDataset.load_image
+        if self.augment and self.cache != "ram":
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, hw0, hw
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, hw0, hw
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Просмотр и очистка общего кэша изображений для обучения")
+
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help=f"Папка кэша, если не указан, используется значение IMAGE_CACHE_DIR ({IMAGE_CACHE_DIR})"
+    )
+
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Удалить давно не использованные записи, чтобы размер кэша не превышал --max-size"
+    )
+
+    parser.add_argument(
+        "--max-size",
+        type=float,
+        default=None,
+        help=f"Размер кэша в ГБ для --prune, если не указан, используется значение IMAGE_CACHE_MAX_GB ({IMAGE_CACHE_MAX_GB})"
+    )
+
+    parser.add_argument(
+        "--remove",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Удалить указанные записи (имена из списка) или все записи: --remove all"
+    )
+
+    return parser.parse_args()
+
+
+def print_entries(entries):
+    total = sum(meta["bytes"] for meta in entries)
+    print(f"[INFO] Записей: {len(entries)}, общий размер {total / 1024 ** 3:.2f} ГБ")
+    for meta in sorted(entries, key=lambda meta: -meta["last_used"]):
+        last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(meta["last_used"]))
+        print(f"   - {meta['name']}: {meta['dataset']}, imgsz {meta['imgsz']}, изображений {meta['images']}, "
+              f"{meta['bytes'] / 1024 ** 3:.2f} ГБ, использовалась {last_used}")
+
+
+def main():
+    args = parse_args()
+    cache_dir = args.cache_dir if args.cache_dir else IMAGE_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        print(f"[ERROR] Папка кэша не найдена: {cache_dir}")
+        sys.exit(1)
+
+    if args.remove:
+        names = [meta["name"] for meta in list_entries(cache_dir)]
+        targets = names if args.remove == ["all"] else args.remove
+        for name in targets:
+            if name not in names:
+                print(f"[WARNING] Запись не найдена: {name}")
+                continue
+            if not remove_entry(cache_dir, name):
+                print(f"[WARNING] Запись {name} используется обучением, не удалена")
+                continue
+            print(f"[OK] Удалена запись {name}")
+    elif args.prune:
+        max_size = args.max_size if args.max_size is not None else IMAGE_CACHE_MAX_GB
+        removed = prune_cache(cache_dir, int(max_size * 1024 ** 3))
+        for meta in removed:
+            print(f"[OK] Удалена запись {meta['name']} ({meta['dataset']}, {meta['bytes'] / 1024 ** 3:.2f} ГБ)")
+        if not removed:
+            print(f"[INFO] Размер кэша не превышает {max_size} ГБ, записи не удалены")
+
+    print_entries(list_entries(cache_dir))
+
+
+if __name__ == "__main__":
+    main()
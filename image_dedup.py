@@ -0,0 +1,83 @@
+import json
+from PIL import Image
+
+
+HASH_BITS = 64
+
+
+def image_dhash(image_path):
+    """
+    Разностный перцептивный хэш (dHash, 64 бита): изображение уменьшается до 9x8
+    в оттенках серого, каждый бит - сравнение соседних пикселей в строке.
+    Для JPEG используется draft-режим (декодирование сразу в уменьшенном размере).
+    Возвращает None, если изображение не удалось прочитать.
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.draft("L", (64, 64))
+            pixels = list(img.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def new_dedup_index(threshold):
+    """
+    Индекс для поиска хэшей на расстоянии Хэмминга <= threshold.
+    Хэш делится на threshold + 1 частей: у близких хэшей хотя бы одна часть совпадает,
+    поэтому кандидаты ищутся в словарях частей, а не перебором всех хэшей.
+    """
+    chunks = min(threshold + 1, HASH_BITS)
+    bounds = [HASH_BITS * i // chunks for i in range(chunks + 1)]
+    return {
+        "threshold": threshold,
+        "chunks": [(bounds[i], bounds[i + 1] - bounds[i]) for i in range(chunks)],
+        "buckets": [{} for _ in range(chunks)],
+        "items": [],
+    }
+
+
+def chunk_keys(dedup_index, phash):
+    return [(phash >> shift) & ((1 << width) - 1) for shift, width in dedup_index["chunks"]]
+
+
+def find_duplicate(dedup_index, phash):
+    """Первый добавленный элемент с близким хэшем или None"""
+    best = None
+    for bucket, key in zip(dedup_index["buckets"], chunk_keys(dedup_index, phash)):
+        for item_id in bucket.get(key, ()):
+            other_hash, _ = dedup_index["items"][item_id]
+            if (other_hash ^ phash).bit_count() <= dedup_index["threshold"]:
+                if best is None or item_id < best:
+                    best = item_id
+    if best is None:
+        return None
+    return dedup_index["items"][best][1]
+
+
+def add_to_index(dedup_index, phash, item):
+    item_id = len(dedup_index["items"])
+    dedup_index["items"].append((phash, item))
+    for bucket, key in zip(dedup_index["buckets"], chunk_keys(dedup_index, phash)):
+        bucket.setdefault(key, []).append(item_id)
+
+
+def save_dedup_report(report_path, pair_counts, threshold, action):
+    report = {
+        "threshold": threshold,
+        "action": action,
+        "total": sum(pair_counts.values()),
+        "dataset_pairs": [
+            {"datasets": list(pair), "duplicates": count}
+            for pair, count in sorted(pair_counts.items(), key=lambda kv: -kv[1])
+        ],
+    }
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from annotation_index import index_file_path, load_index, save_index
+
+
+IMAGE_INDEX_DIR_NAME = "image_index"
+IMAGE_INDEX_VERSION = 1
+MIN_IMAGE_SIDE = 10  # Минимальный размер стороны, как в проверке Ultralytics
+IMAGE_STATUSES = ["ok", "unreadable", "truncated", "too_small"]
+SKIP_STATUSES = ["unreadable", "too_small"]  # Такие изображения Ultralytics пропускает; JPEG без маркера конца он восстанавливает
+
+
+def probe_image(image_path):
+    """
+    Проверка изображения по заголовку без декодирования пикселей: формат, размер
+    с учетом ориентации EXIF (как exif_size в Ultralytics) и для JPEG - маркер конца EOI.
+    Возвращает (формат, ширина, высота, статус из IMAGE_STATUSES).
+    """
+    try:
+        with Image.open(image_path) as img:
+            fmt = img.format or ""
+            w, h = img.size
+            orientation = img.getexif().get(0x0112, 1)
+    except Exception:
+        return "", 0, 0, "unreadable"
+
+    if orientation in (5, 6, 7, 8):
+        w, h = h, w
+    if w < MIN_IMAGE_SIDE or h < MIN_IMAGE_SIDE:
+        return fmt, w, h, "too_small"
+
+    if fmt in ("JPEG", "MPO"):
+        try:
+            with open(image_path, "rb") as f:
+                f.seek(-2, os.SEEK_END)
+                if f.read() != b"\xff\xd9":
+                    return fmt, w, h, "truncated"
+        except OSError:
+            return fmt, w, h, "unreadable"
+    return fmt, w, h, "ok"
+
+
+def scan_image_files(dataset_path, image_dirs, image_exts):
+    """Список (относительный путь, mtime_ns, размер) изображений в каталогах image_dirs"""
+    exts = {ext.lower() for ext in image_exts}
+    entries = []
+    for images_dir in image_dirs:
+        if not os.path.isdir(images_dir):
+            continue
+        rel_dir = os.path.relpath(images_dir, dataset_path)
+        with os.scandir(images_dir) as it:
+            for entry in it:
+                if os.path.splitext(entry.name)[1].lower() not in exts or not entry.is_file():
+                    continue
+                st = entry.stat()
+                entries.append((os.path.join(rel_dir, entry.name), st.st_mtime_ns, st.st_size))
+    entries.sort()
+    return entries
+
+
+def empty_image_index():
+    return {
+        "version": np.array(IMAGE_INDEX_VERSION),
+        "files": np.array([], dtype=str),
+        "mtimes": np.array([], dtype=np.int64),
+        "sizes": np.array([], dtype=np.int64),
+        "formats": np.array([], dtype=str),
+        "widths": np.array([], dtype=np.int32),
+        "heights": np.array([], dtype=np.int32),
+        "statuses": np.array([], dtype=np.int8),
+    }
+
+
+def update_image_index(dataset_path, image_dirs, image_exts, index=None, workers=1):
+    """
+    Обновление индекса изображений датасета: проверяются только новые изображения
+    и изображения с измененными mtime или размером (в пуле потоков).
+    Возвращает (новый индекс, число проверенных изображений).
+    """
+    if index is None or "statuses" not in index:
+        index = empty_image_index()
+
+    cached = {}
+    for file_id, name in enumerate(index["files"]):
+        cached[str(name)] = (file_id, int(index["mtimes"][file_id]), int(index["sizes"][file_id]))
+
+    entries = scan_image_files(dataset_path, image_dirs, image_exts)
+    rows = [None] * len(entries)
+    to_probe = []
+    for i, (rel_path, mtime, size) in enumerate(entries):
+        hit = cached.get(rel_path)
+        if hit is not None and hit[1] == mtime and hit[2] == size:
+            file_id = hit[0]
+            rows[i] = (
+                str(index["formats"][file_id]), int(index["widths"][file_id]),
+                int(index["heights"][file_id]), int(index["statuses"][file_id]),
+            )
+        else:
+            to_probe.append(i)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        paths = [os.path.join(dataset_path, entries[i][0]) for i in to_probe]
+        for i, (fmt, w, h, status) in zip(to_probe, executor.map(probe_image, paths)):
+            rows[i] = (fmt, w, h, IMAGE_STATUSES.index(status))
+
+    if not entries:
+        return empty_image_index(), 0
+
+    new_index = {
+        "version": np.array(IMAGE_INDEX_VERSION),
+        "files": np.array([rel_path for rel_path, _, _ in entries], dtype=str),
+        "mtimes": np.array([mtime for _, mtime, _ in entries], dtype=np.int64),
+        "sizes": np.array([size for _, _, size in entries], dtype=np.int64),
+        "formats": np.array([row[0] for row in rows], dtype=str),
+        "widths": np.array([row[1] for row in rows], dtype=np.int32),
+        "heights": np.array([row[2] for row in rows], dtype=np.int32),
+        "statuses": np.array([row[3] for row in rows], dtype=np.int8),
+    }
+    return new_index, len(to_probe)
+
+
+def load_image_index(index_dir, dataset_name):
+    """Сохраненный индекс изображений датасета без проверки измененных файлов (None - индекса нет)"""
+    return load_index(index_file_path(index_dir, dataset_name), IMAGE_INDEX_VERSION)
+
+
+def refresh_image_index(index_dir, dataset_name, dataset_path, image_dirs, image_exts, workers=1):
+    """Загрузка индекса изображений датасета, проверка измененных файлов и сохранение на диск"""
+    index_path = index_file_path(index_dir, dataset_name)
+    old_index = load_index(index_path, IMAGE_INDEX_VERSION)
+    index, probed = update_image_index(dataset_path, image_dirs, image_exts, old_index, workers)
+    if probed or old_index is None or len(index["files"]) != len(old_index["files"]):
+        save_index(index_path, index)
+
+    bad = int(np.count_nonzero(index["statuses"]))
+    print(f"[INFO] Изображения {dataset_name}: {len(index['files'])}, поврежденных {bad}, проверено {probed}")
+    return index
+
+
+def image_records(index, dataset_path):
+    """Словарь {путь к изображению: (статус, ширина, высота)} для поиска по путям из dataset_former.py"""
+    return {
+        os.path.join(dataset_path, str(name)): (IMAGE_STATUSES[status], int(w), int(h))
+        for name, status, w, h in zip(index["files"], index["statuses"], index["widths"], index["heights"])
+    }
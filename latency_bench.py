@@ -0,0 +1,196 @@
+import os
+import csv
+import glob
+import time
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+from ultralytics.data.utils import IMG_FORMATS, check_det_dataset
+from shard_io import ShardReader
+
+
+BENCH_FORMATS = ["onnx", "openvino", "torchscript"]
+BENCH_BATCHES = [1, 4, 8]
+BENCH_THREADS = [1, 2, 4]
+BENCH_IMAGES = 32  # Число тестовых изображений для замеров
+BENCH_WARMUP = 3
+BENCH_RUNS = 20
+LATENCY_CSV_NAME = "latency_metrics"
+LATENCY_FIELDS = ["format", "batch", "threads", "p50_ms", "p95_ms", "images_per_second", "size_mb"]
+
+
+def split_image_files(split_path):
+    """
+    Изображения split, как в BaseDataset.get_img_files Ultralytics: split_path - папка (рекурсивно),
+    файл-список путей (пути вида ./... считаются от папки списка, как у --virtual) или список из них.
+    """
+    files = []
+    for path in split_path if isinstance(split_path, list) else [split_path]:
+        if os.path.isdir(path):
+            files += glob.glob(os.path.join(glob.escape(path), "**", "*.*"), recursive=True)
+        elif os.path.isfile(path):
+            parent = os.path.dirname(path) + os.sep
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.read().strip().splitlines()
+            files += [line.replace("./", parent, 1) if line.startswith("./") else line for line in lines]
+        else:
+            raise FileNotFoundError(f"Не найден путь выборки: {path}")
+    return sorted(path for path in files if path.rpartition(".")[-1].lower() in IMG_FORMATS)
+
+
+def read_test_images(data_yaml, count=BENCH_IMAGES):
+    """
+    До count изображений test-выборки датасета (BGR), для датасетов в шардах - из шардов split.
+    Если test-выборки нет, используется val.
+    """
+    data = check_det_dataset(data_yaml)
+    split_path = data.get("test") or data.get("val")
+
+    images = []
+    if data.get("shards"):
+        if isinstance(split_path, list):
+            split_path = split_path[0]
+        shards = ShardReader(split_path)
+        for name in shards.names("images/")[:count]:
+            im = cv2.imdecode(np.frombuffer(shards.read(name), np.uint8), cv2.IMREAD_COLOR)
+            if im is not None:
+                images.append(im)
+        shards.close()
+    else:
+        for path in split_image_files(split_path)[:count]:
+            im = cv2.imread(path)
+            if im is not None:
+                images.append(im)
+
+    if not images:
+        raise FileNotFoundError(f"Не найдены тестовые изображения датасета {data_yaml} (выборка: {split_path})")
+    return images
+
+
+def preprocess_images(images, img_size):
+    """Letterbox до img_size и перевод в NCHW float32 [0, 1], как при предсказании Ultralytics"""
+    letterbox = LetterBox((img_size, img_size), auto=False)
+    tensors = [letterbox(image=im)[..., ::-1].transpose(2, 0, 1) for im in images]
+    return np.ascontiguousarray(np.stack(tensors)).astype(np.float32) / 255
+
+
+def export_model(weights, fmt, img_size):
+    """Экспорт весов в формат fmt (путь к файлу или папке модели); батч динамический, где формат это поддерживает"""
+    model = YOLO(weights)
+    return model.export(format=fmt, imgsz=img_size, dynamic=fmt != "torchscript", device="cpu")
+
+
+def load_runner(fmt, path, threads):
+    """Функция инференса на CPU с threads потоками для экспортированной модели: runner(batch NCHW float32)"""
+    if fmt == "torchscript":
+        torch.set_num_threads(threads)
+        model = torch.jit.load(path, map_location="cpu").eval()
+
+        def runner(batch):
+            with torch.inference_mode():
+                return model(torch.from_numpy(batch))
+        return runner
+
+    if fmt == "onnx":
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        input_name = session.get_inputs()[0].name
+        return lambda batch: session.run(None, {input_name: batch})
+
+    if fmt == "openvino":
+        import openvino
+        xml_path = path if path.endswith(".xml") else glob.glob(os.path.join(path, "*.xml"))[0]
+        core = openvino.Core()
+        compiled = core.compile_model(
+            core.read_model(xml_path), "CPU",
+            {"INFERENCE_NUM_THREADS": threads, "PERFORMANCE_HINT": "LATENCY"}
+        )
+        return lambda batch: compiled(batch)
+
+    raise ValueError(f"Неизвестный формат: {fmt}")
+
+
+def model_size_mb(path):
+    if os.path.isdir(path):
+        size = sum(os.path.getsize(p) for p in glob.glob(os.path.join(path, "*")) if os.path.isfile(p))
+    else:
+        size = os.path.getsize(path)
+    return round(size / 1024 ** 2, 2)
+
+
+def measure_latency(runner, inputs, batch):
+    """Задержка (p50, p95 в мс) и пропускная способность на batch изображений из inputs (по кругу)"""
+    def next_batch(step):
+        ids = [(step * batch + i) % len(inputs) for i in range(batch)]
+        return np.ascontiguousarray(inputs[ids])
+
+    for step in range(BENCH_WARMUP):
+        runner(next_batch(step))
+
+    latencies = []
+    for step in range(BENCH_RUNS):
+        x = next_batch(step)
+        start = time.perf_counter()
+        runner(x)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    return (
+        round(float(np.percentile(latencies, 50)), 2),
+        round(float(np.percentile(latencies, 95)), 2),
+        round(float(batch * BENCH_RUNS / (latencies.sum() / 1000)), 2),
+    )
+
+
+def benchmark_formats(weights, data_yaml, img_size, formats=BENCH_FORMATS, batches=BENCH_BATCHES, threads=BENCH_THREADS):
+    """
+    Экспорт весов в форматы formats и замер задержки на CPU на тестовых изображениях
+    для каждого сочетания размера batch и числа потоков. Формат, который не удалось
+    экспортировать или загрузить (нет onnxruntime, openvino), пропускается с предупреждением.
+    Возвращает строки таблицы с полями LATENCY_FIELDS.
+    """
+    images = read_test_images(data_yaml)
+    inputs = preprocess_images(images, img_size)
+    print(f"[INFO] Замер задержки на {len(images)} тестовых изображениях, imgsz {img_size}")
+
+    rows = []
+    torch_threads = torch.get_num_threads()
+    try:
+        for fmt in formats:
+            try:
+                path = str(export_model(weights, fmt, img_size))
+            except Exception as e:
+                print(f"[WARNING] Экспорт в {fmt} не выполнен, формат пропущен: {e}")
+                continue
+
+            for thread_count in threads:
+                try:
+                    runner = load_runner(fmt, path, thread_count)
+                except Exception as e:
+                    print(f"[WARNING] Не удалось загрузить модель {fmt}, формат пропущен: {e}")
+                    break
+                for batch in batches:
+                    p50, p95, throughput = measure_latency(runner, inputs, batch)
+                    rows.append({
+                        "format": fmt, "batch": batch, "threads": thread_count,
+                        "p50_ms": p50, "p95_ms": p95, "images_per_second": throughput,
+                        "size_mb": model_size_mb(path),
+                    })
+                    print(f"   - {fmt}, batch {batch}, потоков {thread_count}: p50 {p50:.1f} мс, "
+                          f"p95 {p95:.1f} мс, {throughput:.1f} изобр/с")
+    finally:
+        torch.set_num_threads(torch_threads)
+    return rows
+
+
+def save_latency_csv(rows, csv_file):
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=LATENCY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return csv_file
@@ -1,7 +1,31 @@
 import sys
 import os
+import io
+import csv
+import math
+import time
+import itertools
 import argparse
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import OrderedDict
+import cv2
+import yaml
+import numpy as np
+import torch
+from PIL import Image
 from ultralytics import YOLO
+from ultralytics.data.build import build_yolo_dataset
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer, DetectionValidator
+from ultralytics.utils import colorstr, torch_utils
+from ultralytics.utils.ops import segments2boxes
+from shard_io import ShardReader
+from autotune import tune_training, save_autotune
+from image_cache import IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_GB, ImageCacheMixin, open_image_cache
+from latency_bench import (
+    BENCH_FORMATS, BENCH_BATCHES, BENCH_THREADS, LATENCY_CSV_NAME, benchmark_formats, save_latency_csv
+)
 
 
 DATASET_PATH = "/media/user/Data/IndustrialSafety/Datasets/HardHatSkz"
@@ -10,9 +34,15 @@ MODEL_VERSION = "yolov8n"
 EPOCHS = 50
 BATCH = 16
 IMG_SIZE = 640
+WARM_MODELS = 2  # Число моделей, которые держит в памяти training_queue.py --warm
+SWEEP_PARALLEL = 2
+SWEEP_KEYS = ["model", "epochs", "batch", "img-size"]
+SWEEP_RESULTS_FILE = "sweep_results.csv"
 
+MODEL_CACHE = OrderedDict()
 
-def parse_args():
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Обучение моделей")
 
     parser.add_argument(
@@ -64,16 +94,426 @@ def parse_args():
         help="Путь к папке с моделью"
     )
 
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help=(
+            "Перед обучением подобрать batch и число воркеров загрузчика короткими замерами на датасете "
+            "(batch подбирается, только если не указан --batch; с --sweep подбирается только число воркеров, "
+            "batch берется из сетки, --batch или значения BATCH); выбор сохраняется в autotune.json"
+        )
+    )
+
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=None,
+        help="Бюджет памяти для --autotune в ГБ (память GPU или оперативная память), "
+             "если не указан, используется доля AUTOTUNE_MEMORY_FRACTION памяти устройства"
+    )
+
+    resume_group = parser.add_mutually_exclusive_group()
+    resume_group.add_argument(
+        "--resume",
+        action="store_true",
+        help="Продолжить прерванное обучение из train/weights/last.pt (ошибка, если продолжать нечего); "
+             "если не указаны --resume и --fresh, прерванное обучение продолжается автоматически"
+    )
+
+    resume_group.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Начать обучение заново: прежняя папка train переименовывается в train_<дата_время>"
+    )
+
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="После тестирования экспортировать best.pt и замерить задержку на CPU (результат в latency_metrics.csv)"
+    )
+
+    parser.add_argument(
+        "--export-formats",
+        type=str,
+        default=None,
+        help=f"Форматы экспорта для --benchmark через запятую, "
+             f"если не указан, используется значение BENCH_FORMATS ({','.join(BENCH_FORMATS)})"
+    )
+
+    parser.add_argument(
+        "--bench-batches",
+        type=str,
+        default=None,
+        help=f"Размеры batch для --benchmark через запятую, "
+             f"если не указан, используется значение BENCH_BATCHES ({','.join(map(str, BENCH_BATCHES))})"
+    )
+
+    parser.add_argument(
+        "--bench-threads",
+        type=str,
+        default=None,
+        help=f"Числа потоков CPU для --benchmark через запятую, "
+             f"если не указан, используется значение BENCH_THREADS ({','.join(map(str, BENCH_THREADS))})"
+    )
+
+    parser.add_argument(
+        "--image-cache",
+        action="store_true",
+        help="Использовать общий кэш уменьшенных до --img-size изображений (image_cache.py), общий для всех обучений на датасете"
+    )
+
+    parser.add_argument(
+        "--image-cache-dir",
+        type=str,
+        default=None,
+        help=f"Папка общего кэша изображений, если не указан, используется значение IMAGE_CACHE_DIR ({IMAGE_CACHE_DIR})"
+    )
+
+    parser.add_argument(
+        "--image-cache-size",
+        type=float,
+        default=None,
+        help=f"Максимальный размер общего кэша изображений в ГБ, "
+             f"если не указан, используется значение IMAGE_CACHE_MAX_GB ({IMAGE_CACHE_MAX_GB})"
+    )
+
+    parser.add_argument(
+        "--sweep",
+        type=str,
+        default=None,
+        help=(
+            "Сетка параметров для серии обучений, например \"model=yolov8n,yolov8s;img-size=320,640;epochs=10\" "
+            f"(ключи: {', '.join(SWEEP_KEYS)}; не указанные в сетке параметры берутся из остальных аргументов)"
+        )
+    )
+
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=None,
+        help=f"Число одновременных обучений в режиме --sweep (ядра CPU делятся между ними поровну), "
+             f"если не указан, используется значение SWEEP_PARALLEL ({SWEEP_PARALLEL})"
+    )
+
     parser.add_argument(
         "--test-only",
         action="store_true",
         help="Выполнить только тестирование без обучения"
     )
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
+
+
+def parse_label_rows(rows):
+    """
+    Разбор строк аннотации YOLO, как в verify_image_label Ultralytics: строки из 5 значений - рамки,
+    строки полигонов (класс и не меньше 3 точек) переводятся в рамки через segments2boxes.
+    Строки другой длины пропускаются. Возвращает (массив (n, 5) cls+xywh, сегменты, число пропущенных строк);
+    сегменты сохраняются, только если все строки - полигоны.
+    """
+    boxes, polygons, skipped = [], [], 0
+    for row in rows:
+        if len(row) == 5:
+            boxes.append(np.array(row, dtype=np.float32))
+        elif len(row) >= 7 and len(row) % 2 == 1:
+            polygons.append((np.float32(row[0]), np.array(row[1:], dtype=np.float32).reshape(-1, 2)))
+        else:
+            skipped += 1
+
+    segments = []
+    if polygons:
+        classes = np.array([cls for cls, _ in polygons], dtype=np.float32).reshape(-1, 1)
+        segments = [segment for _, segment in polygons]
+        boxes.extend(np.concatenate((classes, segments2boxes(segments)), 1))
+        if len(polygons) != len(boxes):
+            segments = []
+    lb = np.array(boxes, dtype=np.float32).reshape(-1, 5)
+    return lb, segments, skipped
+
+
+class ShardYOLODataset(YOLODataset):
+    """
+    Датасет Ultralytics, читающий изображения и аннотации из шардов dataset_former.py --shards.
+    img_path - каталог split с index.json, пути изображений вида <img_path>/images/<имя>.
+    """
+
+    def __init__(self, *args, img_path, **kwargs):
+        self.shards = ShardReader(img_path)
+        super().__init__(*args, img_path=img_path, **kwargs)
+
+    def get_img_files(self, img_path):
+        return [os.path.join(img_path, name) for name in self.shards.names("images/")]
+
+    def get_labels(self):
+        labels = []
+        for im_file in self.im_files:
+            name = os.path.relpath(im_file, self.img_path)
+            with Image.open(io.BytesIO(self.shards.read(name))) as img:
+                w, h = img.size
+
+            label_name = "labels/" + os.path.splitext(os.path.basename(name))[0] + ".txt"
+            rows = []
+            if label_name in self.shards:
+                text = bytes(self.shards.read(label_name)).decode("utf-8")
+                rows = [line.split() for line in text.splitlines() if line.strip()]
+            lb, segments, skipped = parse_label_rows(rows)
+            if skipped:
+                print(f"[WARNING] {label_name}: пропущено строк с неверным числом значений: {skipped}")
+
+            labels.append({
+                "im_file": im_file,
+                "shape": (h, w),
+                "cls": lb[:, 0:1],
+                "bboxes": lb[:, 1:],
+                "segments": segments,
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            })
+        return labels
+
+    def read_image(self, i):
+        name = os.path.relpath(self.im_files[i], self.img_path)
+        flags = getattr(self, "cv2_flag", cv2.IMREAD_COLOR)
+        im = cv2.imdecode(np.frombuffer(self.shards.read(name), np.uint8), flags)
+        if im is None:
+            raise FileNotFoundError(f"Не удалось декодировать изображение из шарда: {name}")
+        return im
+
+    def load_image(self, i, rect_mode=True, resize_short=False):
+        im = self.ims[i]
+        if im is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+        im = self.read_image(i)
+
+        # Изменение размера повторяет BaseDataset.load_image
+        h0, w0 = im.shape[:2]
+        if rect_mode:
+            r = self.imgsz / (min(h0, w0) if resize_short else max(h0, w0))
+            if r != 1:
+                if resize_short:
+                    w, h = (math.ceil(w0 * r), self.imgsz) if h0 < w0 else (self.imgsz, math.ceil(h0 * r))
+                else:
+                    w, h = (min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz))
+                im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+        elif not (h0 == w0 == self.imgsz):
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+        if im.ndim == 2:
+            im = im[..., None]
+
+        if self.augment and self.cache != "ram":
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if self.cache != "ram":
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+
+        return im, (h0, w0), im.shape[:2]
+
+
+class CachedYOLODataset(ImageCacheMixin, YOLODataset):
+    """YOLODataset, читающий уменьшенные изображения из общего кэша (image_cache.py)"""
+
+
+class CachedShardYOLODataset(ImageCacheMixin, ShardYOLODataset):
+    """ShardYOLODataset, читающий уменьшенные изображения из общего кэша (image_cache.py)"""
+
+
+def build_detection_dataset(cfg, img_path, batch, data, mode="train", rect=False, stride=32, dataset_class=ShardYOLODataset):
+    return dataset_class(
+        img_path=img_path,
+        imgsz=cfg.imgsz,
+        batch_size=batch,
+        augment=mode == "train",
+        hyp=cfg,
+        rect=cfg.rect or rect,
+        cache=cfg.cache or None,
+        single_cls=cfg.single_cls or False,
+        stride=int(stride),
+        pad=0.0 if mode == "train" else 0.5,
+        prefix=colorstr(f"{mode}: "),
+        task=cfg.task,
+        classes=cfg.classes,
+        data=data,
+        fraction=cfg.fraction if mode == "train" and not isinstance(cfg.fraction, list) else 1.0,
+    )
+
+
+def build_shard_dataset(cfg, img_path, batch, data, mode="train", rect=False, stride=32):
+    return build_detection_dataset(cfg, img_path, batch, data, mode, rect, stride, ShardYOLODataset)
+
+
+def build_training_dataset(cfg, img_path, batch, data, mode, rect, stride, sharded, image_cache):
+    """
+    Датасет для тренера или валидатора: шарды и/или общий кэш изображений.
+    image_cache - (папка кэша, максимальный размер в байтах) или None.
+    """
+    if image_cache is None:
+        if sharded:
+            return build_shard_dataset(cfg, img_path, batch, data, mode=mode, rect=rect, stride=stride)
+        return build_yolo_dataset(cfg, img_path, batch, data, mode=mode, rect=rect, stride=stride)
+
+    dataset_class = CachedShardYOLODataset if sharded else CachedYOLODataset
+    dataset = build_detection_dataset(cfg, img_path, batch, data, mode, rect, stride, dataset_class)
+    cache_dir, max_bytes = image_cache
+    dataset.image_cache = open_image_cache(dataset, cache_dir, max_bytes)
+    return dataset
 
 
-def train_yolo(dataset_path, model_version, epochs, batch, img_size, target_dir):
+class DatasetDetectionTrainer(DetectionTrainer):
+    """Тренер с выбором датасета по признакам класса: sharded - шарды, image_cache - общий кэш изображений"""
+
+    sharded = False
+    image_cache = None
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        model = getattr(self.model, "module", self.model)
+        gs = max(int(model.stride.max() if model else 0), 32)
+        return build_training_dataset(
+            self.args, img_path, batch, self.data, mode, mode == "val", gs, self.sharded, self.image_cache
+        )
+
+
+class DatasetDetectionValidator(DetectionValidator):
+    sharded = False
+    image_cache = None
+
+    def build_dataset(self, img_path, mode="val", batch=None):
+        return build_training_dataset(
+            self.args, img_path, batch, self.data, mode, False, self.stride, self.sharded, self.image_cache
+        )
+
+
+class ShardDetectionTrainer(DatasetDetectionTrainer):
+    sharded = True
+
+
+class ShardDetectionValidator(DatasetDetectionValidator):
+    sharded = True
+
+
+def with_image_cache(cls, image_cache):
+    """Подкласс тренера или валидатора с общим кэшем изображений (Ultralytics создает их сам по классу)"""
+    return type(cls.__name__, (cls,), {"image_cache": image_cache})
+
+
+def is_sharded_dataset(data_yaml):
+    """Проверка признака shards: true в data.yaml (датасет создан dataset_former.py --shards)"""
+    try:
+        with open(data_yaml, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f)
+    except Exception:
+        return False
+    return bool(data and data.get("shards"))
+
+
+def model_weights(model_version):
+    """Файл весов модели: к имени без расширения добавляется .pt"""
+    _, model_ext = os.path.splitext(model_version)
+    return model_version + ".pt" if model_ext == '' else model_version
+
+
+def load_model(model_version):
+    """
+    Модель из кэша MODEL_CACHE или загрузка весов с диска.
+    Кэш заполняет preload_model в постоянном процессе training_queue.py --warm;
+    задача выполняется в дочернем процессе, поэтому изменения модели при обучении кэш не затрагивают.
+    """
+    model = MODEL_CACHE.get(model_weights(model_version))
+    if model is not None:
+        print(f"[INFO] Модель {model_version} взята из кэша процесса")
+        return model
+    return YOLO(model_weights(model_version))
+
+
+def preload_model(model_version, keep=WARM_MODELS):
+    """Загрузка модели в MODEL_CACHE; хранятся keep последних использованных моделей"""
+    weights = model_weights(model_version)
+    model = MODEL_CACHE.pop(weights, None)
+    if model is None:
+        model = YOLO(weights)
+    MODEL_CACHE[weights] = model
+    while len(MODEL_CACHE) > keep:
+        MODEL_CACHE.popitem(last=False)
+    return model
+
+
+def workers_callback(workers):
+    """
+    Callback on_pretrain_routine_start, задающий число воркеров загрузчика:
+    на CPU Ultralytics обнуляет workers в конструкторе тренера, callback вызывается после этого.
+    """
+    def callback(trainer):
+        trainer.args.workers = workers
+    return callback
+
+
+def autotune_training(model, data_yaml, img_size, batch, memory_budget, model_dir):
+    """Подбор batch (если batch=None) и числа воркеров с сохранением результата в model_dir"""
+    def build_train_shards(cfg, img_path, batch, data, stride):
+        return build_shard_dataset(cfg, img_path, batch, data, mode="train", stride=stride)
+
+    if is_sharded_dataset(data_yaml):
+        dataset_builder = build_train_shards
+    else:
+        dataset_builder = None
+
+    print("[INFO] Автоподбор batch и числа воркеров загрузчика")
+    result = tune_training(
+        data_yaml, model.model, img_size,
+        memory_budget=int(memory_budget * 1024 ** 3) if memory_budget else None,
+        batch=batch,
+        dataset_builder=dataset_builder
+    )
+    path = save_autotune(result, model_dir)
+    print(f"[OK] Выбрано: batch {result['batch']}, workers {result['workers']} "
+          f"({result['images_per_second']:.1f} изобр/с), результат сохранен в {path}")
+    return result
+
+
+def checkpoint_state(last_pt):
+    """
+    Состояние last.pt обучения: None - файла нет или он не читается (обучение прервано при записи),
+    иначе словарь с номером последней завершенной эпохи (с 1), числом эпох, числом воркеров
+    и признаком finished. У завершенного обучения Ultralytics удаляет оптимизатор и задает epoch=-1.
+    """
+    if not os.path.exists(last_pt):
+        return None
+    try:
+        ckpt = torch.load(last_pt, map_location="cpu", weights_only=False)
+    except Exception as e:
+        print(f"[WARNING] Не удалось прочитать {last_pt}: {e}")
+        return None
+    train_args = ckpt.get("train_args") or {}
+    epoch = ckpt.get("epoch", -1)
+    return {
+        "epoch": epoch + 1,
+        "epochs": train_args.get("epochs"),
+        "workers": train_args.get("workers"),
+        "finished": epoch < 0 or ckpt.get("optimizer") is None,
+    }
+
+
+def archive_run(train_dir):
+    """Переименование папки прежнего обучения в <train_dir>_<дата_время>"""
+    archived = f"{train_dir}_{time.strftime('%Y%m%d_%H%M%S')}"
+    os.rename(train_dir, archived)
+    print(f"[INFO] Прежние результаты обучения перенесены в {archived}")
+    return archived
+
+
+def train_yolo(dataset_path, model_version, epochs, batch, img_size, target_dir,
+               autotune=False, tune_batch=True, memory_budget=None, run_name=None, image_cache=None,
+               resume=None):
+    """
+    Обучение модели с сохранением результатов в <target_dir>/<датасет>/<run_name>/train.
+    resume=None - прерванное обучение (есть train/weights/last.pt с оптимизатором) продолжается
+    с последней эпохи, завершенное не повторяется, папка train без last.pt переименовывается;
+    resume=True - только продолжение (FileNotFoundError, если продолжать нечего);
+    resume=False - обучение заново, прежняя папка train переименовывается.
+    """
     if not os.path.exists(dataset_path):
         raise FileNotFoundError(f"Папка с датасетом не найдена: {dataset_path}")
     
@@ -88,20 +528,24 @@ def train_yolo(dataset_path, model_version, epochs, batch, img_size, target_dir)
     model_dir = os.path.join(
         target_dir, 
         dataset_name, 
-        f"{model_version.replace('.pt', '')}_{epochs}epochs"
+        run_name if run_name else f"{model_version.replace('.pt', '')}_{epochs}epochs"
         )
     
-    if os.path.exists(model_dir):
-        while True:
-            answer = input(f"[WARNING] Папка с таким названием уже существует: {model_dir}. Продолжить обучение? (y/n): \n").strip().lower()
-            if answer == 'y':
-                break
-            elif answer == 'n':
-                sys.exit(1)
-            else:
-                print("Пожалуйста, введите только 'y' или 'n'.\n")
-    else:
-        os.makedirs(model_dir, exist_ok=True)
+    os.makedirs(model_dir, exist_ok=True)
+    train_dir = os.path.join(model_dir, "train")
+    last_pt = os.path.join(train_dir, "weights", "last.pt")
+    state = checkpoint_state(last_pt) if resume is not False else None
+    resuming = state is not None and not state["finished"]
+
+    if resume and not resuming:
+        raise FileNotFoundError(f"Нет прерванного обучения для продолжения: {last_pt}")
+    if resume is None and state is not None and state["finished"]:
+        print(f"[INFO] Обучение уже завершено, повторно не выполняется: {last_pt}")
+        return model_dir
+    if not resuming and os.path.exists(train_dir):
+        if resume is None:
+            print(f"[WARNING] В {train_dir} нет контрольной точки для продолжения, обучение начинается заново")
+        archive_run(train_dir)
 
     print("\n" + "=" * 60)
     print(f"[INFO] Обучение модели: {model_version}")
@@ -110,22 +554,51 @@ def train_yolo(dataset_path, model_version, epochs, batch, img_size, target_dir)
     print(f"[INFO] Сохранение результатов в {model_dir}")
     print("=" * 60 + "\n")
 
-    _, model_ext = os.path.splitext(model_version)
-    if model_ext == '':
-        model = YOLO(model_version + ".pt")
+    if resuming:
+        print(f"[INFO] Продолжение прерванного обучения: завершено эпох {state['epoch']} из {state['epochs']}, "
+              f"контрольная точка {last_pt}")
+        model = YOLO(last_pt)
     else:
-        model = YOLO(model_version)
+        model = load_model(model_version)
+
+    train_kwargs = {}
+    trainer = DatasetDetectionTrainer
+    if is_sharded_dataset(data_yaml):
+        print("[INFO] Датасет в формате шардов, используется ShardDetectionTrainer")
+        trainer = ShardDetectionTrainer
+        train_kwargs["trainer"] = trainer
+    if image_cache is not None:
+        print(f"[INFO] Используется общий кэш изображений: {image_cache[0]}")
+        train_kwargs["trainer"] = with_image_cache(trainer, image_cache)
+
+    if resuming:
+        # batch, imgsz и остальные параметры Ultralytics берет из контрольной точки
+        train_kwargs["resume"] = True
+        if state["workers"]:
+            model.add_callback("on_pretrain_routine_start", workers_callback(state["workers"]))
+    elif autotune:
+        try:
+            tuned = autotune_training(model, data_yaml, img_size, None if tune_batch else batch, memory_budget, model_dir)
+            batch = tuned["batch"]
+            train_kwargs["workers"] = tuned["workers"]
+            model.add_callback("on_pretrain_routine_start", workers_callback(tuned["workers"]))
+        except Exception as e:
+            print(f"[ERROR] Автоподбор не выполнен, используется batch {batch}: {e}")
 
     try:
-        model.train(
-            data=data_yaml,
-            epochs=epochs,
-            batch=batch,
-            imgsz=img_size,
-            project=model_dir,
-            name="train",
-            exist_ok=False
-        )
+        if resuming:
+            model.train(data=data_yaml, **train_kwargs)
+        else:
+            model.train(
+                data=data_yaml,
+                epochs=epochs,
+                batch=batch,
+                imgsz=img_size,
+                project=model_dir,
+                name="train",
+                exist_ok=False,
+                **train_kwargs
+            )
 
         model_path = os.path.join(model_dir, "train", "weights", "best.pt")
 
@@ -139,7 +612,7 @@ def train_yolo(dataset_path, model_version, epochs, batch, img_size, target_dir)
     return model_dir
 
 
-def test_yolo(model_dir, dataset_path):
+def test_yolo(model_dir, dataset_path, image_cache=None):
     model_path = os.path.join(model_dir, "train", "weights", "best.pt")
     trained_model = YOLO(model_path)
 
@@ -152,13 +625,22 @@ def test_yolo(model_dir, dataset_path):
     print(f"[INFO] Сохранение результатов в {model_dir}")
     print("=" * 60 + "\n")
     
+    val_kwargs = {}
+    validator = DatasetDetectionValidator
+    if is_sharded_dataset(data_yaml):
+        validator = ShardDetectionValidator
+        val_kwargs["validator"] = validator
+    if image_cache is not None:
+        val_kwargs["validator"] = with_image_cache(validator, image_cache)
+
     try:
         result = trained_model.val(
             data=data_yaml, 
             split='test', 
             project=model_dir, 
             name="test",
-            exist_ok = False
+            exist_ok = False,
+            **val_kwargs
             )
 
         csv_file = save_metrics_csv(result, model_dir)
@@ -170,36 +652,263 @@ def test_yolo(model_dir, dataset_path):
         else:
             print("[ERROR] .csv файл не найден. Проверьте лог Ultralytics.")
         print("-" * 60 + "\n")
+        return result.results_dict
     except Exception as e:
         print(f"[ERROR] Не удалось протестировать {model_dir} на датасете {dataset_path}: {e}")
+        return None
 
 
-def save_metrics_csv(test_result, model_dir):
-    base_name = "test_metrics"
-    ext = ".csv"
+def unique_csv_path(model_dir, base_name, ext=".csv"):
+    """Путь model_dir/base_name.csv, при наличии файла - base_name_1.csv, base_name_2.csv и т.д."""
     csv_file = os.path.join(model_dir, base_name + ext)
-    
+
     counter = 1
     while os.path.exists(csv_file):
         csv_file = os.path.join(model_dir, f"{base_name}_{counter}{ext}")
         counter += 1
+    return csv_file
+
+
+def save_metrics_csv(test_result, model_dir):
+    csv_file = unique_csv_path(model_dir, "test_metrics")
 
     csv_data = test_result.to_csv()
     with open(csv_file, "w", encoding="utf-8") as f:
         f.write(csv_data)
     
     return csv_file
-    
 
-def main():
-    args = parse_args()
-    
+
+def benchmark_yolo(model_dir, dataset_path, img_size, formats, batches, threads):
+    """Экспорт best.pt и замер задержки на CPU с сохранением таблицы рядом с test_metrics.csv"""
+    model_path = os.path.join(model_dir, "train", "weights", "best.pt")
+    data_yaml = os.path.join(dataset_path, "data.yaml")
+
+    print("\n" + "=" * 60)
+    print(f"[INFO] Экспорт и замер задержки: {model_path}")
+    print(f"[INFO] Форматы: {', '.join(formats)}; batch: {batches}; потоков: {threads}")
+    print("=" * 60 + "\n")
+
+    try:
+        rows = benchmark_formats(model_path, data_yaml, img_size, formats, batches, threads)
+        if not rows:
+            print("[ERROR] Ни один формат не удалось экспортировать и замерить")
+            return
+        csv_file = save_latency_csv(rows, unique_csv_path(model_dir, LATENCY_CSV_NAME))
+        print("\n" + "-" * 60)
+        print(f"[OK] Замер задержки завершен.")
+        print(f"[INFO] Результаты сохранены по пути:\n{csv_file}")
+        print("-" * 60 + "\n")
+    except Exception as e:
+        print(f"[ERROR] Не удалось выполнить замер задержки {model_path}: {e}")
+
+
+def parse_list(value, default, cast=str):
+    """Список из строки через запятую или default, если значение не указано"""
+    if not value:
+        return default
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def parse_sweep_grid(value):
+    """Сетка из строки "model=yolov8n,yolov8s;epochs=10,20" -> {"model": ["yolov8n", "yolov8s"], "epochs": [10, 20]}"""
+    grid = {}
+    for part in value.split(";"):
+        if not part.strip():
+            continue
+        key, _, values = part.partition("=")
+        key = key.strip().lstrip("-").replace("_", "-")
+        if key not in SWEEP_KEYS:
+            raise ValueError(f"Неизвестный параметр сетки: {key} (допустимы: {', '.join(SWEEP_KEYS)})")
+        grid[key] = parse_list(values, [], str if key == "model" else int)
+        if not grid[key]:
+            raise ValueError(f"Не указаны значения параметра сетки: {key}")
+    return grid
+
+
+def sweep_configs(grid, defaults):
+    """Все сочетания значений сетки; параметры, которых нет в сетке, берутся из defaults"""
+    keys = list(grid)
+    configs = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        config = dict(defaults)
+        config.update(zip(keys, values))
+        config["name"] = (f"{config['model'].replace('.pt', '')}_{config['epochs']}epochs_"
+                          f"{config['img-size']}px_b{config['batch']}")
+        configs.append(config)
+    return configs
+
+
+def split_cores(parallel):
+    """Разбиение доступных процессу ядер CPU на parallel непересекающихся групп одинакового размера"""
+    cores = sorted(os.sched_getaffinity(0))
+    parallel = max(1, min(parallel, len(cores)))
+    size = len(cores) // parallel
+    return [cores[i * size:(i + 1) * size] for i in range(parallel)]
+
+
+def run_sweep_job(config, dataset_path, target_dir, cores, log_path, sender, autotune, memory_budget, image_cache,
+                  resume):
+    """
+    Обучение и тестирование одной конфигурации сетки в дочернем процессе (fork).
+    Процесс привязывается к ядрам cores, torch использует столько же потоков; вывод пишется в log_path.
+    С autotune подбирается только число воркеров: batch входит в имя и параметры конфигурации сетки,
+    а одновременные обучения делят память устройства, поэтому отдельный подбор batch в каждом из них неточен.
+    Результат (метрики или ошибка) отправляется в sender.
+    """
+    os.sched_setaffinity(0, cores)
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    torch_utils.NUM_THREADS = len(cores)  # select_device задает это число потоков torch при обучении на CPU
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(log_path, "w", encoding="utf-8") as log, open(os.devnull, "r") as devnull:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        os.dup2(devnull.fileno(), 0)
+
+    result = {"model_dir": None, "metrics": None, "error": None}
+    try:
+        result["model_dir"] = train_yolo(
+            dataset_path=dataset_path,
+            model_version=config["model"],
+            epochs=config["epochs"],
+            batch=config["batch"],
+            img_size=config["img-size"],
+            target_dir=target_dir,
+            autotune=autotune,
+            tune_batch=False,
+            memory_budget=memory_budget,
+            run_name=config["name"],
+            image_cache=image_cache,
+            resume=resume
+        )
+        result["metrics"] = test_yolo(result["model_dir"], dataset_path, image_cache)
+        if result["metrics"] is None:
+            result["error"] = "обучение или тестирование не выполнено, см. лог"
+    except BaseException as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sender.send(result)
+
+
+def run_sweep(configs, dataset_path, target_dir, parallel, autotune=False, memory_budget=None, image_cache=None,
+              resume=None):
+    """
+    Параллельное выполнение конфигураций сетки: одновременно выполняется не больше parallel
+    обучений, каждое на своей группе ядер CPU. Возвращает строки сводной таблицы в порядке configs.
+    """
+    core_groups = split_cores(parallel)
+    dataset_name = os.path.basename(os.path.normpath(dataset_path))
+    sweep_dir = os.path.join(target_dir, dataset_name, time.strftime("sweep_%Y%m%d_%H%M%S"))
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    print(f"[INFO] Конфигураций: {len(configs)}, одновременно: {len(core_groups)}, "
+          f"ядер на обучение: {len(core_groups[0])}")
+    print(f"[INFO] Логи и сводная таблица: {sweep_dir}")
+    if autotune:
+        print("[INFO] --autotune в серии обучений подбирает только число воркеров, batch берется из конфигурации")
+
+    ctx = multiprocessing.get_context("fork")
+    pending = list(enumerate(configs))
+    free_groups = list(core_groups)
+    running = {}
+    rows = [None] * len(configs)
+
+    while pending or running:
+        while pending and free_groups:
+            config_id, config = pending.pop(0)
+            cores = free_groups.pop(0)
+            receiver, sender = ctx.Pipe(duplex=False)
+            log_path = os.path.join(sweep_dir, config["name"] + ".log")
+            process = ctx.Process(
+                target=run_sweep_job,
+                args=(config, dataset_path, target_dir, cores, log_path, sender, autotune, memory_budget, image_cache, resume)
+            )
+            process.start()
+            sender.close()
+            running[process.sentinel] = (process, receiver, config_id, cores, time.perf_counter())
+            print(f"[INFO] Запущено {config['name']} на ядрах {cores[0]}-{cores[-1]}")
+
+        for sentinel in wait(list(running)):
+            process, receiver, config_id, cores, started = running.pop(sentinel)
+            result = receiver.recv() if receiver.poll() else None
+            process.join()
+            free_groups.append(cores)
+
+            config = configs[config_id]
+            if result is None:
+                result = {"model_dir": None, "metrics": None, "error": f"процесс завершился с кодом {process.exitcode}"}
+            rows[config_id] = {
+                "name": config["name"],
+                "model": config["model"],
+                "epochs": config["epochs"],
+                "batch": config["batch"],
+                "img_size": config["img-size"],
+                "cores": len(cores),
+                "status": "error" if result["error"] else "ok",
+                "wall_seconds": round(time.perf_counter() - started, 1),
+                **(result["metrics"] or {}),
+                "model_dir": result["model_dir"] or "",
+            }
+            done = sum(row is not None for row in rows)
+            if result["error"]:
+                print(f"[ERROR] [{done}/{len(configs)}] {config['name']}: {result['error']}")
+            else:
+                print(f"[OK] [{done}/{len(configs)}] {config['name']} за {rows[config_id]['wall_seconds']:.0f} с")
+
+    csv_file = save_sweep_csv(rows, os.path.join(sweep_dir, SWEEP_RESULTS_FILE))
+    print(f"[OK] Сводная таблица сохранена в {csv_file}")
+    return rows
+
+
+def save_sweep_csv(rows, csv_file):
+    fields = []
+    for row in rows:
+        fields.extend(field for field in row if field not in fields)
+    fields.append(fields.pop(fields.index("model_dir")))
+    with open(csv_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    return csv_file
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
     data = args.data if args.data else DATASET_PATH
     model_version = args.model if args.model else MODEL_VERSION
     epochs = args.epochs if args.epochs else EPOCHS
     batch = args.batch if args.batch else BATCH
     img_size = args.img_size if args.img_size else IMG_SIZE
     target_dir = args.target_path if args.target_path else MODELS_BASE_DIR
+    resume = True if args.resume else False if args.fresh else None
+    image_cache = None
+    if args.image_cache:
+        image_cache = (
+            args.image_cache_dir if args.image_cache_dir else IMAGE_CACHE_DIR,
+            int((args.image_cache_size if args.image_cache_size else IMAGE_CACHE_MAX_GB) * 1024 ** 3),
+        )
+
+    if args.sweep:
+        try:
+            grid = parse_sweep_grid(args.sweep)
+        except ValueError as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+        defaults = {"model": model_version, "epochs": epochs, "batch": batch, "img-size": img_size}
+        run_sweep(
+            sweep_configs(grid, defaults), data, target_dir,
+            parallel=args.parallel if args.parallel else SWEEP_PARALLEL,
+            autotune=args.autotune,
+            memory_budget=args.memory_budget,
+            image_cache=image_cache,
+            resume=resume
+        )
+        return
 
     if not args.test_only:
         model_dir = train_yolo(
@@ -208,16 +917,30 @@ def main():
             epochs=epochs,
             batch=batch,
             img_size=img_size,
-            target_dir=target_dir
+            target_dir=target_dir,
+            autotune=args.autotune,
+            tune_batch=args.batch is None,
+            memory_budget=args.memory_budget,
+            image_cache=image_cache,
+            resume=resume
         )
 
-        test_yolo(model_dir, data)
+        test_yolo(model_dir, data, image_cache)
     else:
         model_dir = args.model_dir
         if model_dir:
-            test_yolo(model_dir, data)
+            test_yolo(model_dir, data, image_cache)
         else:
             print(f"[ERROR] Не указан путь к модели")
+            return
+
+    if args.benchmark:
+        benchmark_yolo(
+            model_dir, data, img_size,
+            formats=parse_list(args.export_formats, BENCH_FORMATS),
+            batches=parse_list(args.bench_batches, BENCH_BATCHES, int),
+            threads=parse_list(args.bench_threads, BENCH_THREADS, int)
+        )
 
     
 if __name__ == "__main__":
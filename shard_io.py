@@ -0,0 +1,100 @@
+import os
+import io
+import json
+import mmap
+import tarfile
+
+
+SHARD_INDEX_FILE = "index.json"
+SHARD_MAX_BYTES = 1024 ** 3  # 1 ГБ на шард
+
+
+class ShardWriter:
+    """
+    Запись файлов одного split в несколько tar-шардов без сжатия.
+    Для каждого файла в index.json сохраняются (шард, смещение данных, размер),
+    что позволяет читать файлы из шардов с произвольным доступом.
+    """
+
+    def __init__(self, split_dir, max_bytes=SHARD_MAX_BYTES):
+        self.split_dir = split_dir
+        self.max_bytes = max_bytes
+        self.index = {}
+        self.shard_id = -1
+        self.tar = None
+        self.shard_name = None
+        os.makedirs(split_dir, exist_ok=True)
+
+    def _next_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+        self.shard_id += 1
+        self.shard_name = f"{self.shard_id:05d}.tar"
+        self.tar = tarfile.open(os.path.join(self.split_dir, self.shard_name), "w", format=tarfile.GNU_FORMAT)
+
+    def _add(self, member_name, fileobj, size, mtime):
+        if self.tar is None or self.tar.offset + size > self.max_bytes:
+            self._next_shard()
+        info = tarfile.TarInfo(member_name)
+        info.size = size
+        info.mtime = mtime
+        header = info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        offset_data = self.tar.offset + len(header)
+        self.tar.addfile(info, fileobj)
+        self.index[member_name] = [self.shard_name, offset_data, size]
+
+    def add_file(self, member_name, src_path):
+        st = os.stat(src_path)
+        with open(src_path, "rb") as f:
+            self._add(member_name, f, st.st_size, int(st.st_mtime))
+
+    def add_bytes(self, member_name, data, mtime=0):
+        self._add(member_name, io.BytesIO(data), len(data), mtime)
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+        tmp_path = os.path.join(self.split_dir, SHARD_INDEX_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.split_dir, SHARD_INDEX_FILE))
+
+
+class ShardReader:
+    """Чтение файлов из шардов split по index.json (шарды отображаются в память при первом обращении)"""
+
+    def __init__(self, split_dir):
+        self.split_dir = split_dir
+        with open(os.path.join(split_dir, SHARD_INDEX_FILE), "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        self._maps = {}
+
+    def names(self, prefix=""):
+        return sorted(name for name in self.index if name.startswith(prefix))
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def _map(self, shard_name):
+        mapped = self._maps.get(shard_name)
+        if mapped is None:
+            with open(os.path.join(self.split_dir, shard_name), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard_name] = mapped
+        return mapped
+
+    def read(self, name):
+        shard_name, offset, size = self.index[name]
+        return self._map(shard_name)[offset:offset + size]
+
+    def __getstate__(self):
+        # Отображения не передаются в процессы загрузчика данных, каждый открывает свои
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
@@ -0,0 +1,92 @@
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+STAGE_REPORT_FILE = "stage_report.json"
+
+
+class StageStats:
+    """
+    Счетчики этапов обработки: число вызовов, байты, файлы и время по этапам и исходным датасетам.
+    Этапы, выполняемые в пуле потоков, суммируют время всех потоков,
+    поэтому сумма по этапам может превышать общее время выполнения.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, dataset=None, seconds=0.0, nbytes=0, files=0, calls=1):
+        key = dataset if dataset is not None else ""
+        with self.lock:
+            record = self.stages.setdefault(stage, {}).setdefault(
+                key, {"calls": 0, "seconds": 0.0, "bytes": 0, "files": 0}
+            )
+            record["calls"] += calls
+            record["seconds"] += seconds
+            record["bytes"] += nbytes
+            record["files"] += files
+
+    @contextmanager
+    def measure(self, stage, dataset=None):
+        """Замер времени блока; в блоке можно задать record["bytes"] и record["files"]"""
+        record = {"bytes": 0, "files": 0}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add(stage, dataset, time.perf_counter() - start, record["bytes"], record["files"])
+
+    def report(self):
+        stages = {}
+        for stage, datasets in self.stages.items():
+            total = {"calls": 0, "seconds": 0.0, "bytes": 0, "files": 0}
+            for record in datasets.values():
+                for field in total:
+                    total[field] += record[field]
+            stages[stage] = {
+                **{field: round(value, 4) if field == "seconds" else value for field, value in total.items()},
+                "datasets": {
+                    name: {**record, "seconds": round(record["seconds"], 4)}
+                    for name, record in sorted(datasets.items()) if name
+                },
+            }
+        return {"wall_seconds": round(time.perf_counter() - self.started, 4), "stages": stages}
+
+    def save(self, report_path):
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=4)
+
+    def print_summary(self):
+        report = self.report()
+        print(f"\n[INFO] Время выполнения: {report['wall_seconds']:.2f} с")
+        for stage, total in sorted(report["stages"].items(), key=lambda kv: -kv[1]["seconds"]):
+            print(f"   - {stage}: {total['seconds']:.2f} с, вызовов {total['calls']}, "
+                  f"{total['bytes'] / 1024 ** 2:.1f} МБ")
+
+
+def measure(stage_stats, stage, dataset=None):
+    """StageStats.measure или пустой контекст, если stage_stats не задан"""
+    if stage_stats is None:
+        return nullcontext({"bytes": 0, "files": 0})
+    return stage_stats.measure(stage, dataset)
+
+
+@contextmanager
+def profiled(profile_path):
+    """Профилирование блока cProfile с сохранением результата в profile_path (None - без профилирования)"""
+    if not profile_path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        print(f"[OK] Профиль сохранен в {profile_path} (просмотр: python -m pstats {profile_path})")
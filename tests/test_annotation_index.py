@@ -0,0 +1,53 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from annotation_index import update_index, make_index_filter
+from dataset_former import read_filtered_label
+
+
+LABELS = {
+    "a.txt": "0 0.500 0.250 0.1000 0.20\n2  0.1   0.2 0.3 0.4\n",
+    "b.txt": "1 0.1 0.2 0.5 0.2 0.5 0.6 0.1 0.6\nx 0.1 0.1 0.1 0.1\n0\n",
+    "c.txt": "",
+}
+REMAP = {0: "1", 1: "0"}
+
+
+def write_labels(labels_dir):
+    os.makedirs(labels_dir, exist_ok=True)
+    for name, text in LABELS.items():
+        with open(os.path.join(labels_dir, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def test_index_filter_matches_text_filter(tmp_path):
+    labels_dir = os.path.join(str(tmp_path), "labels")
+    write_labels(labels_dir)
+    index, reparsed = update_index(str(tmp_path), [labels_dir])
+    filter_fn = make_index_filter(index, str(tmp_path), REMAP, lambda path: None)
+
+    assert reparsed == len(LABELS)
+    for name in LABELS:
+        label_path = os.path.join(labels_dir, name)
+        assert filter_fn(label_path) == read_filtered_label(label_path, REMAP)
+    assert filter_fn(os.path.join(labels_dir, "a.txt")) == ["1 0.500 0.250 0.1000 0.20\n"]
+
+
+def test_update_index_rereads_only_changed_files(tmp_path):
+    labels_dir = os.path.join(str(tmp_path), "labels")
+    write_labels(labels_dir)
+    index, _ = update_index(str(tmp_path), [labels_dir])
+
+    same_index, reparsed = update_index(str(tmp_path), [labels_dir], index)
+    assert reparsed == 0 and same_index is index
+
+    with open(os.path.join(labels_dir, "c.txt"), "w", encoding="utf-8") as f:
+        f.write("1 0.3 0.3 0.2 0.2\n")
+    index, reparsed = update_index(str(tmp_path), [labels_dir], index)
+    filter_fn = make_index_filter(index, str(tmp_path), REMAP, lambda path: None)
+
+    assert reparsed == 1
+    assert filter_fn(os.path.join(labels_dir, "c.txt")) == ["0 0.3 0.3 0.2 0.2\n"]
+    assert filter_fn(os.path.join(labels_dir, "b.txt")) == read_filtered_label(os.path.join(labels_dir, "b.txt"), REMAP)
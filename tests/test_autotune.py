@@ -0,0 +1,33 @@
+import os
+import sys
+import types
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import autotune
+
+
+def test_device_is_resolved_in_probe_process():
+    result = autotune.run_probe(autotune.resolve_device, "cpu", None)
+
+    assert result["device"] == "cpu"
+    assert isinstance(result["memory_budget"], int) and result["memory_budget"] > 0
+    assert not torch.cuda.is_initialized()
+
+
+def test_failed_probes_are_reported(monkeypatch):
+    def failing_probe(*args):
+        raise RuntimeError("Cannot re-initialize CUDA in forked subprocess")
+
+    monkeypatch.setattr(autotune, "probe_config", failing_probe)
+    monkeypatch.setattr(autotune, "check_det_dataset", lambda data_yaml: {"train": "train"})
+    base_model = types.SimpleNamespace(stride=torch.tensor([8.0, 16.0, 32.0]))
+
+    with pytest.raises(RuntimeError, match="Все замеры batch завершились ошибкой.*re-initialize CUDA"):
+        autotune.tune_training(
+            "data.yaml", base_model, 64, memory_budget=2 ** 30,
+            dataset_builder=lambda cfg, img_path, batch, data, stride: list(range(100))
+        )
@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datasets_json_former
+
+
+def make_dataset(datasets_dir, name):
+    dataset_path = os.path.join(datasets_dir, name)
+    for sub in ["images", "labels"]:
+        os.makedirs(os.path.join(dataset_path, sub))
+    with open(os.path.join(dataset_path, "data.yaml"), "w", encoding="utf-8") as f:
+        f.write("names: ['helmet', 'vest']\nnc: 2\n")
+    for i in range(3):
+        with open(os.path.join(dataset_path, "images", f"{i}.jpg"), "wb") as f:
+            f.write(b"\xff\xd8\xff\xd9")
+        with open(os.path.join(dataset_path, "labels", f"{i}.txt"), "w", encoding="utf-8") as f:
+            f.write("0 0.5 0.5 0.1 0.1\n")
+
+
+def test_rescan_checks_stats_only_of_changed_datasets(tmp_path, monkeypatch):
+    datasets_dir = str(tmp_path)
+    for name in ["a", "b"]:
+        make_dataset(datasets_dir, name)
+    args = argparse.Namespace(
+        datasets_path=datasets_dir, output_path=None, workers=1, force=False, stats=True,
+        probe_images=False, build_index=False
+    )
+    datasets_json_former.scan_datasets(args)
+
+    with open(os.path.join(datasets_dir, "b", "labels", "0.txt"), "w", encoding="utf-8") as f:
+        f.write("1 0.5 0.5 0.1 0.1\n")
+    scanned = []
+    scan_stats_files = datasets_json_former.scan_stats_files
+
+    def counting_scan(images_path, labels_path, signature):
+        scanned.append(os.path.relpath(labels_path, datasets_dir).split(os.sep)[0])
+        return scan_stats_files(images_path, labels_path, signature)
+
+    monkeypatch.setattr(datasets_json_former, "scan_stats_files", counting_scan)
+    datasets_json_former.scan_datasets(args, rescan={"b"})
+
+    with open(os.path.join(datasets_dir, datasets_json_former.OUTPUT_FILE), encoding="utf-8") as f:
+        datasets_info = json.load(f)
+    assert scanned == ["b"]
+    assert "stats" in datasets_info["a"]
+    classes = datasets_info["b"]["stats"]["splits"]["all"]["classes"]
+    assert {name: stats["instances"] for name, stats in classes.items()} == {"helmet": 2, "vest": 1}
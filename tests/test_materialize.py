@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from dataset_former import materialize_file, copy_pair
+
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_copy_replaces_link_left_by_previous_merge(tmp_path):
+    first, second, dst = (str(tmp_path / name) for name in ("first.jpg", "second.jpg", "out.jpg"))
+    write_file(first, b"first")
+    write_file(second, b"second")
+
+    for mode in ["hardlink", "symlink"]:
+        assert materialize_file(first, dst, mode) == mode
+        assert materialize_file(second, dst, "copy") == "copy"
+
+        assert read_file(first) == b"first"
+        assert read_file(dst) == b"second"
+        assert not os.path.islink(dst) and os.stat(dst).st_nlink == 1
+
+
+def test_resize_replaces_link_left_by_previous_merge(tmp_path):
+    source = str(tmp_path / "source.png")
+    image_dst, label_dst = str(tmp_path / "out.png"), str(tmp_path / "out.txt")
+    Image.new("RGB", (64, 32), (200, 10, 10)).save(source)
+    original = read_file(source)
+
+    os.link(source, image_dst)
+    copy_pair(source, image_dst, label_dst, ["0 0.5 0.5 0.1 0.1\n"], resize={"max_side": 16, "format": None, "quality": 90})
+
+    assert read_file(source) == original
+    with Image.open(image_dst) as img:
+        assert img.size == (16, 8)
@@ -0,0 +1,69 @@
+import os
+import sys
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ultralytics.cfg import get_cfg
+from ultralytics.utils import DEFAULT_CFG
+from shard_io import ShardWriter
+from model_training_module import build_shard_dataset, parse_label_rows
+
+
+SEGMENT_ROW = "1 0.1 0.2 0.5 0.2 0.5 0.6 0.1 0.6"
+BOX_ROW = "0 0.5 0.5 0.2 0.4"
+
+
+def write_shard(split_dir, label_text):
+    ok, encoded = cv2.imencode(".jpg", np.zeros((32, 48, 3), np.uint8))
+    assert ok
+    writer = ShardWriter(split_dir)
+    writer.add_bytes("images/img0.jpg", encoded.tobytes())
+    writer.add_bytes("labels/img0.txt", label_text.encode("utf-8"))
+    writer.close()
+
+
+def shard_labels(split_dir):
+    cfg = get_cfg(DEFAULT_CFG, {"imgsz": 64})
+    data = {"nc": 2, "names": {0: "helmet", 1: "vest"}, "channels": 3}
+    dataset = build_shard_dataset(cfg, split_dir, 1, data, mode="val")
+    return dataset.labels[0]
+
+
+def test_parse_label_rows_converts_polygons_to_boxes():
+    lb, segments, skipped = parse_label_rows([SEGMENT_ROW.split()])
+
+    assert skipped == 0
+    assert lb.shape == (1, 5)
+    np.testing.assert_allclose(lb[0], [1, 0.3, 0.4, 0.4, 0.4], atol=1e-6)
+    assert len(segments) == 1 and segments[0].shape == (4, 2)
+
+
+def test_parse_label_rows_skips_malformed_rows():
+    lb, segments, skipped = parse_label_rows([BOX_ROW.split(), "0 0.5 0.5".split(), "1 0.1 0.2 0.3 0.4 0.5".split()])
+
+    assert skipped == 2
+    assert lb.shape == (1, 5)
+    assert segments == []
+
+
+def test_shard_dataset_reads_segment_label(tmp_path):
+    split_dir = str(tmp_path / "val")
+    write_shard(split_dir, SEGMENT_ROW + "\n")
+
+    label = shard_labels(split_dir)
+
+    assert label["cls"].tolist() == [[1.0]]
+    np.testing.assert_allclose(label["bboxes"], [[0.3, 0.4, 0.4, 0.4]], atol=1e-6)
+    assert len(label["segments"]) == 1
+
+
+def test_shard_dataset_reads_mixed_label(tmp_path):
+    split_dir = str(tmp_path / "val")
+    write_shard(split_dir, BOX_ROW + "\n" + SEGMENT_ROW + "\n")
+
+    label = shard_labels(split_dir)
+
+    assert sorted(label["cls"].ravel().tolist()) == [0.0, 1.0]
+    assert label["bboxes"].shape == (2, 4)
@@ -0,0 +1,41 @@
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset_former import stratified_split_pairs
+
+
+SOURCE_DIR = "/data"
+LABELS = {f"/data/ds/labels/img{i}.txt": ["1 0.5 0.5 0.1 0.1\n"] if i % 10 == 0 else ["0 0.5 0.5 0.1 0.1\n"]
+          for i in range(200)}
+FILTERS = {"ds": lambda label_src: LABELS[label_src]}
+
+
+def make_pairs():
+    return [(None, "ds", label_src.replace("labels", "images")[:-4] + ".jpg", label_src) for label_src in LABELS]
+
+
+def split_map(pairs, merge_manifest=None):
+    result = stratified_split_pairs(pairs, FILTERS, SOURCE_DIR, 4, merge_manifest)
+    return {label_src: split_name for split_name, _, _, label_src in result}
+
+
+def test_stratified_split_does_not_depend_on_order():
+    pairs = make_pairs()
+    splits = split_map(pairs)
+
+    assert split_map(list(reversed(pairs))) == splits
+    rare = Counter(splits[label_src] for label_src, lines in LABELS.items() if lines[0][0] == "1")
+    assert rare == {"train": 16, "valid": 2, "test": 2}
+
+
+def test_stratified_split_keeps_manifest_splits():
+    pairs = make_pairs()
+    kept = {label_src: {"split": "test"} for label_src in list(LABELS)[:20:10]}
+    splits = split_map(pairs, {"entries": kept})
+
+    assert all(splits[label_src] == "test" for label_src in kept)
+    rare = Counter(splits[label_src] for label_src, lines in LABELS.items() if lines[0][0] == "1")
+    assert rare == {"train": 16, "valid": 2, "test": 2}
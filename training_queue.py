@@ -1,5 +1,9 @@
 import sys
 import os
+import shlex
+import argparse
+import importlib
+import traceback
 import subprocess
 import time
 
@@ -7,10 +11,34 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 QUEUE_TXT = os.path.join(BASE_DIR, "training_queue.txt")
 TMP_DIR = os.path.join(BASE_DIR, "tmp")
 STATUS_FILE = os.path.join(BASE_DIR, "tmp/status.txt")
+WARM_MODULES = ["dataset_former", "model_training_module"]
 
 os.makedirs(TMP_DIR, exist_ok=True)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Очередь задач обучения из training_queue.txt")
+
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help=(
+            "Постоянный процесс: Ultralytics и модули из WARM_MODULES импортируются один раз, "
+            "задачи этих модулей выполняются в дочернем процессе (fork) без повторного запуска python3"
+        )
+    )
+
+    parser.add_argument(
+        "--warm-models",
+        type=int,
+        default=None,
+        help="Число последних использованных моделей, хранимых в памяти в режиме --warm, "
+             "если не указан, используется значение WARM_MODELS из model_training_module.py"
+    )
+
+    return parser.parse_args()
+
+
 def main_window():
     subprocess.Popen([
         "gnome-terminal", "--",
@@ -40,6 +68,95 @@ def start_new_process(cmd):
     return result
 
 
+def parse_command(line):
+    """Имя модуля и аргументы задачи очереди: "python3 model_training_module.py --epochs 2" -> ("model_training_module", ["--epochs", "2"])"""
+    arguments = shlex.split(line.strip())
+    if arguments and os.path.basename(arguments[0]).startswith("python"):
+        arguments = arguments[1:]
+    if not arguments:
+        return None, []
+    module_name = os.path.splitext(os.path.basename(arguments[0]))[0]
+    return module_name, arguments[1:]
+
+
+def warm_up():
+    """Импорт модулей задач (вместе с ними torch и Ultralytics) в постоянном процессе"""
+    modules = {}
+    start = time.perf_counter()
+    for module_name in WARM_MODULES:
+        modules[module_name] = importlib.import_module(module_name)
+    print(f"[INFO] Модули {', '.join(WARM_MODULES)} загружены за {time.perf_counter() - start:.1f} с")
+    return modules
+
+
+def preload_job_model(modules, module_name, argv, keep):
+    """Загрузка весов модели задачи обучения в кэш постоянного процесса до запуска задачи"""
+    if module_name != "model_training_module":
+        return
+    module = modules[module_name]
+    try:
+        args = module.parse_args(argv)
+        if not args.test_only:
+            module.preload_model(args.model if args.model else module.MODEL_VERSION, keep)
+    except (Exception, SystemExit) as e:
+        # Ошибку аргументов или весов покажет сама задача
+        print(f"[WARNING] Не удалось заранее загрузить модель: {e}")
+
+
+def run_in_process(module, module_name, argv):
+    """
+    Выполнение main(argv) модуля в дочернем процессе (fork) постоянного процесса.
+    Дочерний процесс получает уже импортированные модули и загруженные модели,
+    а его изменения состояния и падение не затрагивают очередь и следующие задачи.
+    Возвращает код завершения (отрицательный - завершение по сигналу).
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            sys.argv = [module_name + ".py"] + argv
+            module.main(argv)
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                code = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    _, status = os.waitpid(pid, 0)
+    result = os.waitstatus_to_exitcode(status)
+    if result < 0:
+        print(f"[ERROR] Задача {module_name} завершена сигналом {-result}")
+    return result
+
+
+def run_task(task, modules, warm_models):
+    """Запуск задачи очереди: в постоянном процессе для модулей из WARM_MODULES, иначе через python3"""
+    if modules is not None:
+        try:
+            module_name, argv = parse_command(task)
+        except ValueError as e:
+            print(f"[ERROR] Ошибка при обработке команды: {e}")
+            return 1
+        if module_name in modules:
+            preload_job_model(modules, module_name, argv, warm_models)
+            return run_in_process(modules[module_name], module_name, argv)
+
+    cmd = process_line(task)
+    if cmd is None:
+        return 1
+    return start_new_process(cmd)
+
+
 def read_txt(txt_file):
     try:
         with open(txt_file, "r", encoding="utf-8") as f:
@@ -93,6 +210,19 @@ def save_statuses(statuses):
 
 
 def main():
+    args = parse_args()
+    warm_models = args.warm_models
+
+    modules = None
+    if args.warm:
+        if hasattr(os, "fork"):
+            modules = warm_up()
+            # Импорт после warm_up: без --warm очередь не загружает torch и Ultralytics
+            from model_training_module import WARM_MODELS
+            warm_models = warm_models if warm_models else WARM_MODELS
+        else:
+            print("[WARNING] Режим --warm требует os.fork, задачи будут запускаться через python3")
+
     main_window()
     statuses = load_statuses()
 
@@ -118,8 +248,7 @@ def main():
             statuses[next_task] = "Выполняется"
             save_statuses(statuses)
             
-            cmd = process_line(next_task)
-            result = start_new_process(cmd)
+            result = run_task(next_task, modules, warm_models)
 
             if result == 0:
                 statuses[next_task] = "Выполнено"